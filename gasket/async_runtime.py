@@ -0,0 +1,328 @@
+"""Runs the hostapd control sockets and the faucet reload confirmation on one asyncio
+event loop (on its own thread), instead of a thread each.
+The work they produce goes on the AuthApp's work queue as it does with threads.
+
+Messages from hostapd are received by reader callbacks, and the requests that
+follow them (STA, PING) are sent and answered the same way, so a hostapd only has
+a thread while it is being (re)connected to (HostapdCtrl's reconnect blocks).
+Faucet's events are still consumed by the RabbitMQ thread (pika's BlockingConnection).
+Compared to the threads it uses far fewer threads and less CPU while idle, but more CPU
+per message, and a burst of messages from many hostapds is handled one at a time by the loop.
+See performance-tests/bench_runtime.py.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+from gasket import auth_app_utils
+
+
+class HostapdChannel(object):
+    """Handles a HostapdSocket's messages on the event loop.
+    Messages are handled in order, those that arrive while a request (or reconnect)
+    for an earlier message is outstanding wait in the backlog.
+    """
+
+    runtime = None
+    hostapd = None
+    loop = None
+
+    # (unsolicited, request) file descriptors being read, None while (re)connecting.
+    reading = None
+    # (callback, timer) of the request waiting for its reply. (None, None) while blocking.
+    pending = None
+    # messages received while pending.
+    backlog = None
+    # time of the last message (or ping), to know when to ping.
+    last_receive = None
+    stopped = False
+    # max messages read per reader callback, so one busy hostapd does not hold up the others.
+    max_batch = 64
+
+    def __init__(self, runtime, hostapd):
+        """
+        Args:
+            runtime (AsyncRuntime)
+            hostapd (hostapd_socket_thread.HostapdSocket)
+        """
+        self.runtime = runtime
+        self.hostapd = hostapd
+        self.loop = runtime.loop
+        self.backlog = collections.deque()
+        self.last_receive = time.time()
+
+    def start(self):
+        """Connects to hostapd (on a thread), then starts receiving.
+        """
+        self.run_blocking(self.hostapd.init_sockets)
+
+    def run_blocking(self, func):
+        """Runs func on its own thread, as it may block until hostapd is up.
+        Stops reading until it returns, as it may replace the sockets.
+        """
+        self.stop_reading()
+        self.pending = (None, None)
+        # back to blocking (with a timeout), for HostapdCtrl's requests.
+        for ctrl in (self.hostapd.unsolicited_sock, self.hostapd.request_sock):
+            if ctrl is not None and ctrl.soc is not None:
+                try:
+                    ctrl.set_timeout(ctrl.timeout)
+                except OSError:
+                    # closed, func will reconnect.
+                    pass
+
+        def target():
+            error = None
+            try:
+                func()
+            except Exception as e:
+                error = e
+            try:
+                self.loop.call_soon_threadsafe(self.blocking_done, error)
+            except RuntimeError:
+                # event loop has been closed.
+                pass
+
+        threading.Thread(target=target, name='%s-connect' % self.hostapd.conf.name,
+                         daemon=True).start()
+
+    def blocking_done(self, error):
+        if error is not None:
+            self.hostapd.logger.exception(error)
+            return
+        self.pending = None
+        self.last_receive = time.time()
+        if self.stopped:
+            return
+        # read until there is nothing left, rather than waiting for data.
+        for ctrl in (self.hostapd.unsolicited_sock, self.hostapd.request_sock):
+            ctrl.soc.setblocking(False)
+        self.reading = (self.hostapd.unsolicited_sock.soc.fileno(),
+                        self.hostapd.request_sock.soc.fileno())
+        self.loop.add_reader(self.reading[0], self.on_message)
+        self.loop.add_reader(self.reading[1], self.on_reply, True)
+        self.done()
+
+    def stop_reading(self):
+        if self.reading is not None:
+            for fileno in self.reading:
+                self.loop.remove_reader(fileno)
+            self.reading = None
+
+    def on_message(self):
+        """Reader callback for the unsolicited socket.
+        Reads the messages waiting (up to max_batch), rather than one per callback.
+        """
+        for _ in range(self.max_batch):
+            if not self.reading:
+                return
+            try:
+                data = str(self.hostapd.unsolicited_sock.receive())
+            except BlockingIOError:
+                return
+            except OSError as e:
+                self.on_error(e)
+                return
+            self.last_receive = time.time()
+            if self.pending:
+                self.backlog.append(data)
+            else:
+                self.handle_message(data)
+
+    def handle_message(self, data):
+        try:
+            if 'CTRL-EVENT-EAP-SUCCESS' in data:
+                # needs the STA MIB from hostapd.
+                self.hostapd.logger.info('received message: %s', data)
+                mac = data.split()[1].replace("'", '')
+                self.request('STA %s' % mac, lambda reply: self.on_sta(mac, reply))
+            else:
+                self.hostapd.handle_message(data)
+        except Exception as e:
+            self.hostapd.logger.error('exception in run.')
+            self.hostapd.logger.exception(e)
+
+    def on_sta(self, mac, reply):
+        if reply is None:
+            self.hostapd.logger.warning('request socket timed out while getting mib for mac: %s',
+                                        mac)
+            return
+        self.hostapd.auth_success(mac, self.hostapd.request_sock.to_dict(reply))
+
+    def ping(self):
+        """Like HostapdSocket.check_connection(), but only needs a thread
+        if hostapd does not reply and needs reconnecting to.
+        """
+        if self.stopped or self.pending:
+            # busy, so not idle.
+            return
+        self.last_receive = time.time()
+        self.request('PING', self.on_pong)
+
+    def on_pong(self, reply):
+        if reply != 'PONG\n':
+            self.hostapd.logger.info('no reply to ping')
+            self.run_blocking(self.hostapd.check_connection)
+
+    def request(self, cmd, callback):
+        """Sends a request to hostapd, and calls callback with the reply
+        (None if there is none within the request socket's timeout).
+        Args:
+            cmd (str)
+            callback (function)
+        """
+        ctrl = self.hostapd.request_sock
+        try:
+            ctrl.send_request(cmd)
+        except OSError as e:
+            self.hostapd.logger.info('cannot send request: %s', e)
+            self.pending = (callback, None)
+            self.on_reply(False)
+            return
+        self.pending = (callback, self.loop.call_later(ctrl.timeout, self.on_reply, False))
+
+    def on_reply(self, readable):
+        """Reader callback for the request socket, and the request's timeout.
+        Args:
+            readable (bool): False if the request timed out.
+        """
+        reply = None
+        if readable:
+            try:
+                reply = self.hostapd.request_sock.receive()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                self.on_error(e)
+                return
+        if not self.pending or not self.pending[0]:
+            # e.g. the reply to a request that has timed out.
+            self.hostapd.logger.info('unexpected reply: %s', reply)
+            return
+        callback, timer = self.pending
+        self.pending = None
+        if timer:
+            timer.cancel()
+        try:
+            callback(reply)
+        except Exception as e:
+            self.hostapd.logger.error('exception in run.')
+            self.hostapd.logger.exception(e)
+        self.done()
+
+    def done(self):
+        """Handles the backlog, now the previous message is done with.
+        """
+        while self.backlog and not self.pending:
+            self.handle_message(self.backlog.popleft())
+
+    def on_error(self, e):
+        self.stop_reading()
+        if self.stopped:
+            self.hostapd.logger.info('Bad file descriptor after shutdown')
+            return
+        self.hostapd.logger.error('OSError exception in run. self.stop has not been set.')
+        self.hostapd.logger.exception(e)
+
+    def stop(self):
+        """Stops receiving. Must be called on the event loop.
+        """
+        self.stopped = True
+        self.stop_reading()
+        if self.pending and self.pending[1]:
+            self.pending[1].cancel()
+
+
+class AsyncRuntime(threading.Thread):
+    """Thread running the event loop.
+    Has kill() like the threads it replaces, so AuthApp can stop it the same way.
+    """
+
+    hostapds = None
+    confirmer = None
+    logger = None
+
+    loop = None
+    executor = None
+    channels = None
+    stop = False
+
+    def __init__(self, hostapds, confirmer, logger_location):
+        """
+        Args:
+            hostapds (list): of hostapd_socket_thread.HostapdSocket.
+            confirmer (reload_confirmer.ReloadConfirmer): the rule manager's. Not started.
+            logger_location (str)
+        """
+        super().__init__(name='asyncio', daemon=True)
+        self.hostapds = list(hostapds)
+        self.confirmer = confirmer
+        self.logger = auth_app_utils.get_logger('async_runtime', logger_location,
+                                                logging.INFO, 1)
+        self.loop = asyncio.new_event_loop()
+        # for the confirmer's prometheus scrapes and signals.
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='async-confirmer')
+        self.loop.set_default_executor(self.executor)
+        self.channels = [HostapdChannel(self, hostapd) for hostapd in self.hostapds]
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.logger.info('running %d hostapds on the event loop', len(self.hostapds))
+        for channel in self.channels:
+            channel.start()
+        tasks = [self.loop.create_task(self.run_pinger())]
+        if self.confirmer:
+            tasks.append(self.loop.create_task(self.run_confirmer()))
+        try:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        finally:
+            for channel in self.channels:
+                channel.stop()
+            self.executor.shutdown(wait=False)
+            self.loop.close()
+        self.logger.info('event loop stopped')
+
+    async def run_pinger(self):
+        """Pings the hostapds that have not sent a message within their unsolicited_timeout.
+        One timer for all of them, rather than a receive timeout each.
+        """
+        interval = min([h.conf.unsolicited_timeout for h in self.hostapds] or [1])
+        while not self.stop:
+            await asyncio.sleep(interval)
+            now = time.time()
+            for channel in self.channels:
+                if now - channel.last_receive >= channel.hostapd.conf.unsolicited_timeout:
+                    channel.ping()
+
+    async def run_confirmer(self):
+        """Coroutine version of ReloadConfirmer.run().
+        Sleeps instead of blocking on the confirmer's conditions.
+        """
+        confirmer = self.confirmer
+        while not self.stop:
+            try:
+                if confirmer.unsent or confirmer.outstanding:
+                    # scrapes prometheus and signals faucet.
+                    await self.loop.run_in_executor(self.executor, confirmer.poll)
+                await asyncio.sleep(confirmer.poll_interval)
+            except Exception as e:
+                self.logger.exception(e)
+
+    def kill(self):
+        """Stops the event loop and closes the hostapd sockets.
+        """
+        self.stop = True
+        if self.is_alive():
+            self.loop.call_soon_threadsafe(self._cancel)
+            self.join()
+        for hostapd in self.hostapds:
+            if hostapd.request_sock and hostapd.unsolicited_sock:
+                hostapd.kill()
+
+    def _cancel(self):
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
@@ -7,18 +7,21 @@ and sending it a SIGHUP.
 
 import argparse
 import queue
-import re
 import signal
 import sys
 
 from gasket.auth_config import AuthConfig
+from gasket import async_runtime
 from gasket import auth_app_utils
 from gasket import config_parser
 from gasket import hostapd_socket_thread
 from gasket import rabbitmq
 from gasket import rule_manager
 from gasket import work_item
-from gasket.host import UnlearntUnauthenticatedHost
+from gasket.host import LearntAuthenticatedHost, LearntUnauthenticatedHost
+from gasket.host import UnlearntAuthenticatedHost, UnlearntUnauthenticatedHost
+from gasket.learn_cache import LearnCache
+from gasket.work_queue import PriorityWorkQueue
 
 
 class Proto(object):
@@ -36,9 +39,6 @@ class Proto(object):
     HTTP_PORT = 80
 
 
-LEARNED_MACS_REGEX = r"""learned_macs{dp_id="(0x[a-f0-9]+)",dp_name="([\w-]+)",n="(\d+)",port="(\d+)",vlan="(\d+)"}"""
-
-
 class AuthApp(object):
     '''
     This class recieves messages hostapd_ctrl from the portal via
@@ -55,7 +55,11 @@ class AuthApp(object):
     logname = 'auth_app'
 
     work_queue = None
+    learn_cache = None
+    # seconds the worker waits for work when no changes are pending.
+    idle_timeout = 1
     threads = []
+    prom_scraper = None
 
     dps = {}
     # dp_name : Datapath
@@ -77,8 +81,10 @@ class AuthApp(object):
 
         self.logger = logger
         self.rule_man = rule_manager.RuleManager(self.config, self.logger)
-        self.learned_macs_compiled_regex = re.compile(LEARNED_MACS_REGEX)
-        self.work_queue = queue.Queue()
+        self.prom_scraper = auth_app_utils.PrometheusScraper(self.config.prom_url)
+        self.work_queue = PriorityWorkQueue()
+        if self.config.learn_cache_ttl:
+            self.learn_cache = LearnCache(self.config.learn_cache_ttl, self.config.learn_cache_size)
 
     def start(self):
         """Starts separate thread for each hostapd socket.
@@ -88,6 +94,41 @@ class AuthApp(object):
         """
         signal.signal(signal.SIGINT, self._handle_sigint)
 
+        rt = rabbitmq.RabbitMQ(self.work_queue, self.config.logger_location,
+                               self.rule_man.reload_waiter, self.learn_cache)
+        if self.config.runtime == 'asyncio':
+            self.start_async(rt)
+        else:
+            self.start_threads(rt)
+
+        self.warm_start(self.get_prometheus_mac_table())
+        print('Started socket Threads.')
+        print('Working')
+        self.logger.info('Working worker thread.')
+        while True:
+            try:
+                # wake up when the current rule batch is due, even if there is no new work.
+                # and periodically, to commit again the changes of failed reloads.
+                timeout = self.rule_man.time_until_commit()
+                work = self.work_queue.get(timeout=self.idle_timeout if timeout is None
+                                           else timeout)
+            except queue.Empty:
+                work = None
+            try:
+                if work is not None:
+                    self.process_work(work)
+                if self.rule_man.commit_due():
+                    self.rule_man.commit()
+                    self.logger.info('%s', self.get_stats())
+            except Exception as e:
+                self.logger.exception(e)
+
+    def start_threads(self, rt):
+        """Starts a thread for each hostapd socket, the faucet event consumer and
+        the reload confirmer.
+        Args:
+            rt (rabbitmq.RabbitMQ)
+        """
         self.logger.info('Starting hostapd socket threads')
         print('Starting hostapd socket threads ...')
 
@@ -99,33 +140,62 @@ class AuthApp(object):
             self.threads.append(hst)
             self.logger.info('Thread running')
 
-        rt = rabbitmq.RabbitMQ(self.work_queue, self.config.logger_location)
+        self.rule_man.confirmer.start()
+        self.threads.append(self.rule_man.confirmer)
+
         try:
             rt.start()
             self.threads.append(rt)
         except Exception as e:
             self.logger.exception(e)
 
-        self.get_prometheus_mac_learning()
-        print('Started socket Threads.')
-        print('Working')
-        self.logger.info('Working worker thread.')
-        while True:
-            work = self.work_queue.get()
-            try:
-                self.logger.info('Got %s work from queue ', type(work))
-                if isinstance(work, work_item.AuthWorkItem):
-                    self.authenticate(work.mac, work.username, work.acllist, work.hostapd_name)
-                elif isinstance(work, work_item.DeauthWorkItem):
-                    self.deauthenticate(work.mac, work.hostapd_name)
-                elif isinstance(work, work_item.L2LearnWorkItem):
-                    self.l2learn(work)
-                elif isinstance(work, work_item.PortChangeWorkItem):
-                    self.port_status_handler(work)
-                else:
-                    self.logger.warn("Unsupported WorkItem type: %s", type(work))
-            except Exception as e:
-                self.logger.exception(e)
+    def start_async(self, rt):
+        """Starts the hostapd sockets and the reload confirmer on an asyncio event loop thread
+        (see async_runtime), and a thread for the faucet event consumer.
+        Args:
+            rt (rabbitmq.RabbitMQ)
+        """
+        self.logger.info('Starting asyncio runtime')
+        hostapds = [hostapd_socket_thread.HostapdSocket(hostapd_conf, self.work_queue,
+                                                        self.config.logger_location)
+                    for hostapd_conf in self.hostapds.values()]
+        runtime = async_runtime.AsyncRuntime(hostapds, self.rule_man.confirmer,
+                                             self.config.logger_location)
+        runtime.start()
+        self.threads.append(runtime)
+
+        # pika's BlockingConnection keeps its own thread.
+        try:
+            rt.start()
+            self.threads.append(rt)
+        except Exception as e:
+            self.logger.exception(e)
+
+    def get_stats(self):
+        """Returns:
+            dict of the work queue, faucet reload and learn cache stats.
+        """
+        stats = {'work queue': self.work_queue.stats(), 'reloads': self.rule_man.reload_stats()}
+        if self.learn_cache:
+            stats['learn cache'] = self.learn_cache.stats()
+        return stats
+
+    def process_work(self, work):
+        """Calls the handler for the type of work.
+        Args:
+            work (work_item.WorkItem): work to do.
+        """
+        self.logger.info('Got %s work from queue ', type(work))
+        if isinstance(work, work_item.AuthWorkItem):
+            self.authenticate(work.mac, work.username, work.acllist, work.hostapd_name)
+        elif isinstance(work, work_item.DeauthWorkItem):
+            self.deauthenticate(work.mac, work.hostapd_name)
+        elif isinstance(work, work_item.L2LearnWorkItem):
+            self.l2learn(work)
+        elif isinstance(work, work_item.PortChangeWorkItem):
+            self.port_status_handler(work)
+        else:
+            self.logger.warn("Unsupported WorkItem type: %s", type(work))
 
     def l2learn(self, host_wi):
         """Learns a host, if host is already authenticated rules are applied.
@@ -144,31 +214,86 @@ class AuthApp(object):
 
         self.macs[mac] = self.macs[mac].learn(self.dps[dp_name].ports[port_no])
 
-    def get_prometheus_mac_learning(self):
-        """Queries the prometheus faucet client,
-        And creates L2Learn work for macs already learnt.
+    def warm_start(self, mac_table):
+        """Rebuilds the hosts that were authenticated before gasket (re)started,
+        from the sessions kept by the rule manager, then learns the macs faucet has learnt.
+        Their rules are already in faucet's config, so no reload is needed.
+        Args:
+            mac_table (list of work_item.L2LearnWorkItem): see get_prometheus_mac_table().
+        """
+        sessions = self.rule_man.get_sessions()
+        for mac, session in sessions.items():
+            dp = self.dps.get(session['dp_name'])
+            auth_port = dp.ports.get(session['port']) if dp else None
+            if auth_port is None:
+                # config has changed since the host authenticated.
+                self.logger.warning('port of session for mac %s no longer exists %s',
+                                    mac, session)
+                self.rule_man.deauthenticate(session['username'], mac)
+                continue
+            self.macs[mac] = UnlearntAuthenticatedHost(mac=mac, logger=self.logger,
+                                                       rule_man=self.rule_man,
+                                                       auth_port=auth_port,
+                                                       username=session['username'],
+                                                       acl_list=session['acl_list'])
+            auth_port.add_authed_host(mac)
+        self.logger.info('warm start restored %d authenticated hosts', len(sessions))
+        self.bulk_learn(mac_table)
+
+    def bulk_learn(self, mac_table):
+        """Learns many hosts in a single pass, without going through the work queue.
+        Used at startup before the worker loop, live L2_LEARN events use l2learn().
+        Args:
+            mac_table (list of work_item.L2LearnWorkItem): see get_prometheus_mac_table().
+        """
+        for host_wi in mac_table:
+            mac = host_wi.mac
+            learn_dp = self.dps.get(host_wi.dp_name)
+            port = learn_dp.ports.get(host_wi.port) if learn_dp else None
+            if port is None:
+                continue
+            host = self.macs.get(mac)
+            if host is None:
+                host = LearntUnauthenticatedHost(mac=mac, ip=host_wi.ip, logger=self.logger,
+                                                 rule_man=self.rule_man)
+                self.macs[mac] = host
+            elif isinstance(host, UnlearntAuthenticatedHost):
+                # restored by warm_start(), its rules are already applied.
+                host = LearntAuthenticatedHost(host=host)
+                self.macs[mac] = host
+            elif isinstance(host, UnlearntUnauthenticatedHost):
+                self.macs[mac] = host.learn(port)
+                continue
+            if port.number not in host.learn_ports:
+                host.learn_ports[port.number] = port
+                host.ordered_learn_ports.append(port.number)
+                port.add_learn_host(mac)
+        self.logger.info('learnt %d macs from prometheus', len(mac_table))
+
+    def get_prometheus_mac_table(self):
+        """Queries the prometheus faucet client for the macs already learnt.
+        Returns:
+            list of work_item.L2LearnWorkItem.
         """
         # query faucets promethues.
         self.logger.info('querying prometheus for "learned_macs"')
+        mac_table = []
         try:
-            prom_mac_table = auth_app_utils.scrape_prometheus_vars(self.config.prom_url,
-                                                                   ['learned_macs'])[0]
+            samples = self.prom_scraper.scrape(['learned_macs'])['learned_macs']
         except Exception as e:
             self.logger.exception(e)
-            return
-        self.logger.debug('queried prometheus. mac_table:\n%s\n',
-                          prom_mac_table)
+            return mac_table
+        self.logger.debug('queried prometheus. %d learned_macs', len(samples))
 
-        for line in prom_mac_table:
-            labels, float_as_mac = line.split(' ')
+        for labels, float_as_mac in samples:
+            if not float_as_mac:
+                # unused slot in faucet's table.
+                continue
             macstr = auth_app_utils.float_to_mac(float_as_mac)
-            self.logger.debug('float %s is mac %s', float_as_mac, macstr)
-
-            # if this is also an access port, we have found the dpid and the port
-            values = self.learned_macs_compiled_regex.match(labels)
-            dpid, dp_name, n, port, vlan = values.groups()
-            self.work_queue.put(work_item.L2LearnWorkItem(dp_name, int(dpid, 16), int(port),
-                                                          int(vlan), macstr, None))
+            mac_table.append(work_item.L2LearnWorkItem(labels['dp_name'], int(labels['dp_id'], 16),
+                                                       int(labels['port']), int(labels['vlan']),
+                                                       macstr, None))
+        return mac_table
 
     def authenticate(self, mac, user, acl_list, hostapd_name):
         """Authenticates the user as specifed by adding ACL rules
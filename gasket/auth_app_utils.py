@@ -39,12 +39,12 @@ class HashableDict(dict):
 def float_to_mac(mac_as_float_str):
     """Convert a float string to a mac address string
     Args:
-        mac_as_float_str (str): float represented as a string e.g. "123456.0"
+        mac_as_float_str (str or float): float represented as a string e.g. "123456.0"
             This float should be a whole number. (Right of the decimal == 0)
     Returns:
         MAC Address as a string. e.g. "00:00:00:01:e2:40"
     """
-    _hex = '%012x' % int(mac_as_float_str.split('.')[0])
+    _hex = '%012x' % int(float(mac_as_float_str))
     macstr = _hex[:2] + ':' + _hex[2:4] + \
                  ':' + _hex[4:6] + ':' + _hex[6:8] + \
                  ':' + _hex[8:10] + ':' +  _hex[10:12]
@@ -94,28 +94,91 @@ def get_hashable_list(list_):
         hash_list.append(HashableDict(item))
     return hash_list
 
-def scrape_prometheus(prom_url):
-    """Query prometheus specified by config. Removes comment lines.
+PROM_SAMPLE_REGEX = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:{(.*)})?\s+(\S+)')
+PROM_LABEL_REGEX = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_prometheus_sample(line):
+    """Parses a line of the prometheus text exposition format.
+    Args:
+        line (str): e.g. 'learned_macs{dp_id="0x1",port="2"} 1.0'
     Returns:
-        string containing all prometheus variables without comments.
+        (name, labels dict, float value), or None if the line is not a sample.
     """
-    prom_vars = []
-    for prom_line in requests.get(prom_url).text.split('\n'):
-        if not prom_line.startswith('#'):
-            prom_vars.append(prom_line)
-    return '\n'.join(prom_vars)
-
-def scrape_prometheus_vars(prom_url, variables):
-    prom_txt = scrape_prometheus(prom_url)
-
-    ret = []
-    for v in variables:
-        matches = []
-        for line in prom_txt.splitlines():
-            if line.startswith(v):
-                matches.append(line)
-        ret.append(matches)
-    return ret
+    match = PROM_SAMPLE_REGEX.match(line)
+    if not match:
+        return None
+    name, labels, value = match.groups()
+    label_dict = {}
+    if labels:
+        for label, label_value in PROM_LABEL_REGEX.findall(labels):
+            label_dict[label] = label_value
+    return name, label_dict, float(value)
+
+
+class PrometheusScraper(object):
+    """Scrapes a prometheus client (faucet's) for the samples of some metric families.
+    Reads the response a line at a time, stopping once all of the families wanted
+    have been read. This does not keep the connection open between scrapes,
+    faucet's prometheus client answers with HTTP/1.0 and closes it after every response.
+    Not thread safe, use one per thread.
+    """
+
+    prom_url = None
+    timeout = None
+    session = None
+
+    def __init__(self, prom_url, timeout=5):
+        """
+        Args:
+            prom_url (str)
+            timeout (int): seconds to wait to connect or for data.
+        """
+        self.prom_url = prom_url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def scrape(self, families):
+        """Gets the samples of families.
+        A counter family also matches its '_total' samples (but not '_created').
+        Args:
+            families (list of str): metric names e.g. ['learned_macs']
+        Returns:
+            dict of family : list of (labels dict, float value).
+        Raises:
+            requests.exceptions.RequestException
+        """
+        names = {}
+        for family in families:
+            names[family] = family
+            names[family + '_total'] = family
+        samples = {family: [] for family in families}
+        remaining = set(families)
+        current = None
+        with self.session.get(self.prom_url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if isinstance(line, bytes):
+                    line = line.decode()
+                if not line or line.startswith('#'):
+                    continue
+                sample = parse_prometheus_sample(line)
+                if sample is None:
+                    continue
+                name, labels, value = sample
+                family = names.get(name)
+                if family is not None:
+                    samples[family].append((labels, value))
+                    current = family
+                elif current is not None:
+                    # the samples of a family are together, so it is complete.
+                    remaining.discard(current)
+                    current = None
+                    if not remaining:
+                        # the rest is not read, so the connection is closed rather than reused.
+                        break
+        return samples
+
 
 def signal_docker_container(container_name, signal=None):
     """Sends a signal to a docker container.
@@ -1,8 +1,6 @@
 """Configuration parser for authentication controller app."""
-# pytype: disable=pyi-error
-import yaml
-
 from gasket import gasket_conf_utils
+from gasket import yaml_utils
 
 
 class AuthConfig(object):
@@ -10,7 +8,7 @@ class AuthConfig(object):
     """
 
     def __init__(self, filename):
-        data = yaml.load(open(filename, 'r'))
+        data = yaml_utils.load_file(filename)
 
         self.version = data['version']
         self.logger_location = data['logger_location']
@@ -18,6 +16,11 @@ class AuthConfig(object):
 
         self.logger_level = gasket_conf_utils.get_log_level(log_level)
 
+        # 'threads' runs each hostapd socket, the faucet event consumer & reload confirmer
+        # on a thread. 'asyncio' runs them all on one event loop (see async_runtime).
+        self.runtime = data.get('runtime', 'threads')
+        assert self.runtime in ('threads', 'asyncio'), 'unknown runtime: %s' % self.runtime
+
         # TODO make a config class for 'faucet'
         self.prom_port = data['faucet']['prometheus_port']
         gasket_conf_utils.validate_port(self.prom_port)
@@ -28,6 +31,26 @@ class AuthConfig(object):
 
         self.container_name = data['faucet'].get('container_name', '')
 
+        # seconds to batch (de)authentications for before reloading faucet.
+        # 0 reloads faucet for every change.
+        self.reload_batch_window = data['faucet'].get('reload_batch_window', 0)
+        assert self.reload_batch_window >= 0, 'reload_batch_window must not be negative'
+        # reload faucet once this many changes are waiting. 0 for no limit.
+        self.reload_batch_size = data['faucet'].get('reload_batch_size', 0)
+        assert self.reload_batch_size >= 0, 'reload_batch_size must not be negative'
+        # seconds to wait for faucet to reload before resending the signal.
+        self.reload_timeout = data['faucet'].get('reload_timeout', 20)
+        # number of times to resend the signal before giving up on a reload.
+        self.reload_retries = data['faucet'].get('reload_retries', 1)
+        # max seconds to wait before committing the changes of a failed reload again.
+        # The wait starts at reload_timeout, and doubles with each failure in a row.
+        self.reload_backoff_max = data['faucet'].get('reload_backoff_max', 600)
+        # seconds to drop repeated L2_LEARN events of a mac at the same location for.
+        # 0 (the default) disables.
+        self.learn_cache_ttl = data['faucet'].get('learn_cache_ttl', 0)
+        # number of macs to remember the location of.
+        self.learn_cache_size = data['faucet'].get('learn_cache_size', 100000)
+
         # TODO move these files to new 'faucet' config class
         self.contr_pid_file = data["files"]["controller_pid"]
         self.faucet_config_file = data["files"]["faucet_config"]
@@ -36,12 +59,46 @@ class AuthConfig(object):
         # TODO put this somewhere
         self.base_filename = data['files']['base_config']
 
+        # 'yaml' or 'json'. json is much faster to write (and read), and faucet can load it.
+        self.acl_config_format = data['files'].get('acl_config_format', 'yaml')
+        self.base_config_format = data['files'].get('base_config_format', 'yaml')
+        for fmt in (self.acl_config_format, self.base_config_format):
+            assert fmt in ('yaml', 'json'), 'unknown config format: %s' % fmt
+
+        # backups of acl_config & base_config made before each write.
+        self.backup = data['files'].get('backup', True)
+        # number of backups of each to keep. 0 keeps all.
+        self.backup_keep = data['files'].get('backup_keep', 0)
+        # seconds to keep backups for. 0 keeps them forever.
+        self.backup_max_age = data['files'].get('backup_max_age', 0)
+        # when to fsync acl_config & base_config. 'always', 'batch' or 'none'.
+        self.fsync = data['files'].get('fsync', 'none')
+        assert self.fsync in ('always', 'batch', 'none'), 'unknown fsync: %s' % self.fsync
+        # append only journal of (de)authentications, instead of rewriting base_config each time.
+        self.journal = data['files'].get('journal', None)
+        # number of journal records before they are compacted into base_config.
+        self.journal_compact = data['files'].get('journal_compact', 1000)
+        # directory to keep the history of acl_config & base_config in. None to disable.
+        self.history_dir = data['files'].get('history', None)
+        # number of versions of each to keep in the history. 0 keeps all.
+        self.history_keep = data['files'].get('history_keep', 10000)
+        # seconds to keep versions in the history for. 0 keeps them forever.
+        self.history_max_age = data['files'].get('history_max_age', 0)
+
 
         # dps has a config class
         self.dps = data["dps"]
 
         # TODO move this to the same place 'base_config' goes
         self.rules = data["auth-rules"]["file"]
+        # 'yaml' or 'sqlite'. For 'sqlite' file is a database created by gasket.sqlite_rule_generator.
+        self.rules_backend = data['auth-rules'].get('backend', 'yaml')
+        assert self.rules_backend in ('yaml', 'sqlite'), \
+            'unknown auth-rules backend: %s' % self.rules_backend
+        # number of distinct acl lists (per port) to cache the rules of. 0 disables the cache.
+        self.rules_cache_size = data['auth-rules'].get('cache_size', 1024)
+        # write the rule blocks (e.g. actions) that users share once in the faucet acl file (yaml).
+        self.shared_blocks = data['auth-rules'].get('shared_blocks', False)
 
         # hostapds has a config class
         self.hostapds = data["hostapds"]
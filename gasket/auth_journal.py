@@ -0,0 +1,96 @@
+"""Append only journal of the changes made to the base config's authorisation rules.
+Used instead of rewriting the whole base config on every (de)authentication,
+the journal is replayed over the base (snapshot) file on startup,
+and periodically compacted into it.
+"""
+import json
+import os
+
+
+class AuthJournal(object):
+    """One json record per line.
+    {"op": "add", "user": username, "mac": mac, "rules": {port acl name: [rules]}}
+    {"op": "remove", "keys": [aauth keys]}
+    """
+
+    filename = None
+    logger = None
+    fsync = False
+    # records appended since the last compaction (truncate).
+    count = 0
+    journal_file = None
+
+    def __init__(self, filename, logger, fsync=False):
+        """
+        Args:
+            filename (str)
+            logger
+            fsync (bool): True to fsync each record as it is appended.
+        """
+        self.filename = filename
+        self.logger = logger
+        self.fsync = fsync
+        self.remove_torn_record()
+        self.count = len(self.records())
+        self.journal_file = open(self.filename, 'a')
+
+    def remove_torn_record(self):
+        """Truncates the journal after its last complete record (line),
+        so a record partially written by a crash is not joined to the next one appended.
+        """
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            f.seek(0)
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            self.logger.warning('removing partially written journal record: %s', data[end:])
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def records(self):
+        """Reads the records in the journal.
+        Returns:
+            list of dict.
+        """
+        records = []
+        if not os.path.exists(self.filename):
+            return records
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # partially written record, e.g. from a crash.
+                    self.logger.warning('ignoring invalid journal record: %s', line)
+        return records
+
+    def append(self, record):
+        """Appends a record to the journal.
+        Args:
+            record (dict)
+        """
+        self.journal_file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.journal_file.flush()
+        if self.fsync:
+            os.fsync(self.journal_file.fileno())
+        self.count += 1
+
+    def sync(self):
+        """fsyncs the journal."""
+        os.fsync(self.journal_file.fileno())
+
+    def truncate(self):
+        """Removes all records. Only once they have been written into the base snapshot.
+        """
+        self.journal_file.truncate(0)
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.count = 0
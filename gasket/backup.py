@@ -0,0 +1,99 @@
+"""Rotating backups of the config files gasket writes.
+Primarily for logging, to see how users affect the config.
+"""
+import collections
+import os
+import re
+import shutil
+import time
+
+
+class Backups(object):
+    """Keeps numbered backups (filename.bak1, filename.bak2, ...) of a file.
+    The next number is kept in memory (and persisted to filename.bak-counter),
+    so making a backup does not need to list the directory.
+    Backups are hard links to the current file, which works because the file is
+    replaced with a new one (rename) rather than written to in place.
+    """
+
+    filename = None
+    enabled = True
+    # number of backups to keep. 0 keeps all.
+    keep = 0
+    # seconds to keep backups for. 0 keeps them forever.
+    max_age = 0
+    logger = None
+
+    counter = 0
+    # (number, time) of the backups that exist, oldest first.
+    existing = None
+
+    def __init__(self, filename, logger, enabled=True, keep=0, max_age=0):
+        self.filename = filename
+        self.logger = logger
+        self.enabled = enabled
+        self.keep = keep
+        self.max_age = max_age
+        self.existing = collections.deque()
+        if self.enabled:
+            self._scan()
+            self._prune()
+
+    def _counter_filename(self):
+        return self.filename + '.bak-counter'
+
+    def _backup_filename(self, number):
+        return '%s.bak%d' % (self.filename, number)
+
+    def _scan(self):
+        """Finds the existing backups and the next number to use. Only done at startup.
+        """
+        directory = os.path.dirname(self.filename) or '.'
+        regex = re.compile(re.escape(os.path.basename(self.filename)) + r'\.bak(\d+)$')
+        found = []
+        for name in os.listdir(directory):
+            match = regex.match(name)
+            if match:
+                mtime = os.stat(os.path.join(directory, name)).st_mtime
+                found.append((int(match.group(1)), mtime))
+        found.sort()
+        self.existing.extend(found)
+        self.counter = found[-1][0] if found else 0
+        try:
+            with open(self._counter_filename()) as f:
+                self.counter = max(self.counter, int(f.read()))
+        except (OSError, ValueError):
+            pass
+
+    def backup(self):
+        """Backs up the current file, and removes backups that are no longer to be kept.
+        """
+        if not self.enabled or not os.path.exists(self.filename):
+            return
+        self.counter += 1
+        backup_filename = self._backup_filename(self.counter)
+        try:
+            os.link(self.filename, backup_filename)
+        except OSError:
+            # e.g. file system does not support hard links.
+            shutil.copy2(self.filename, backup_filename)
+        with open(self._counter_filename(), 'w') as f:
+            f.write(str(self.counter))
+        self.existing.append((self.counter, time.time()))
+        self._prune()
+
+    def _prune(self):
+        """Removes the oldest backups that are over the keep or max_age limit.
+        """
+        now = time.time()
+        while self.existing:
+            number, mtime = self.existing[0]
+            if (self.keep and len(self.existing) > self.keep) \
+                    or (self.max_age and now - mtime > self.max_age):
+                self.existing.popleft()
+                try:
+                    os.remove(self._backup_filename(number))
+                except OSError as e:
+                    self.logger.warning('unable to remove backup: %s', e)
+            else:
+                break
@@ -0,0 +1,82 @@
+"""Atomic writing of the config files gasket generates."""
+import os
+
+
+class ConfigWriter(object):
+    """Writes files by writing a temporary file in the same directory and renaming
+    (os.replace) it over the original, so readers (faucet) see either the old or the
+    new file, never a missing or partially written one.
+
+    durability controls fsync:
+        'always': fsync each file (and its directory) as it is written.
+        'batch': files written are only renamed into place on flush(), after all
+                 of them have been fsynced (and then each directory once).
+        'none': never fsync, leaves it to the OS.
+    """
+
+    DURABILITY = ('always', 'batch', 'none')
+
+    durability = 'none'
+    logger = None
+    # list of (tmp filename, filename) waiting for flush(). 'batch' only.
+    pending = None
+
+    def __init__(self, logger, durability='none'):
+        assert durability in self.DURABILITY, 'unknown durability: %s' % durability
+        self.logger = logger
+        self.durability = durability
+        self.pending = []
+
+    def write(self, filename, text, backups=None):
+        """Writes text to filename.
+        Args:
+            filename (str)
+            text (str)
+            backups (backup.Backups): backs up the current file before it is replaced.
+        """
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+            if self.durability == 'always':
+                f.flush()
+                os.fsync(f.fileno())
+        if self.durability == 'batch':
+            self.pending.append((tmp, filename, backups))
+            return
+        self._replace(tmp, filename, backups)
+        if self.durability == 'always':
+            self._fsync_dir(os.path.dirname(filename))
+
+    def flush(self):
+        """Syncs and renames into place the files written since the last flush.
+        Does nothing unless durability is 'batch'.
+        """
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = []
+        for tmp, _, _ in pending:
+            fd = os.open(tmp, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for tmp, filename, backups in pending:
+            self._replace(tmp, filename, backups)
+        for directory in set(os.path.dirname(filename) for _, filename, _ in pending):
+            self._fsync_dir(directory)
+
+    @staticmethod
+    def _replace(tmp, filename, backups):
+        if backups:
+            backups.backup()
+        os.replace(tmp, filename)
+
+    @staticmethod
+    def _fsync_dir(directory):
+        """fsyncs the directory, so renames in it are durable."""
+        fd = os.open(directory or '.', os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
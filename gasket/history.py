@@ -0,0 +1,292 @@
+"""Append only history of the versions (generations) of a config file.
+Each generation is stored as a delta against the previous one, with a full
+copy every keyframe_interval generations, in a single packfile (name.pack)
+with a text index (name.idx) of one line per generation:
+    generation time sha1 kind offset length base_sha1
+Objects are addressed by the sha1 of the content, so a generation identical to an
+earlier one is only an index line.
+Only the newest keep generations (and those newer than max_age seconds) are kept.
+Once keyframe_interval more have expired, the pack & index are rewritten
+starting with a full copy of the oldest generation kept.
+
+Usage:
+    python3 -m gasket.history <directory/name> list
+    python3 -m gasket.history <directory/name> show <generation>
+    python3 -m gasket.history <directory/name> diff <generation> <generation>
+"""
+import difflib
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+
+
+class HistoryStore(object):
+    """History of one file. See module docstring.
+    """
+
+    path = None
+    keyframe_interval = 100
+    # number of generations to keep. 0 keeps all.
+    keep = 0
+    # seconds to keep generations for. 0 keeps them forever.
+    max_age = 0
+
+    generation = 0
+    # sha : (kind, offset, length, base_sha)
+    objects = None
+    # list of (generation, time, sha)
+    generations = None
+    # sha : number of deltas to apply to the nearest full copy.
+    depths = None
+    last_sha = None
+    last_lines = None
+
+    def __init__(self, path, keyframe_interval=100, keep=0, max_age=0):
+        """
+        Args:
+            path (str): directory/name, '.pack' & '.idx' are appended.
+            keyframe_interval (int): store a full copy every this many generations.
+            keep (int): number of generations to keep. 0 keeps all.
+            max_age (float): seconds to keep generations for. 0 keeps them forever.
+        """
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.keep = keep
+        self.max_age = max_age
+        self.objects = {}
+        self.depths = {}
+        self.generations = []
+        self._recover()
+        self._read_index()
+
+    def _recover(self):
+        """Finishes or discards a compaction interrupted by a crash.
+        The new pack replaces the old one before the new index does.
+        """
+        if os.path.exists(self.path + '.pack.new'):
+            # the old pack & index are still in place.
+            for ext in ('.pack.new', '.idx.new'):
+                if os.path.exists(self.path + ext):
+                    os.remove(self.path + ext)
+        elif os.path.exists(self.path + '.idx.new'):
+            os.replace(self.path + '.idx.new', self.path + '.idx')
+
+    def _read_index(self):
+        self.objects = {}
+        self.depths = {}
+        self.generations = []
+        if not os.path.exists(self.path + '.idx'):
+            return
+        with open(self.path + '.idx') as f:
+            for line in f:
+                gen, gen_time, sha, kind, offset, length, base_sha = line.split()
+                if sha not in self.objects:
+                    self.objects[sha] = (kind, int(offset), int(length), base_sha)
+                    self.depths[sha] = 0 if kind == 'full' else self.depths[base_sha] + 1
+                self.generations.append((int(gen), float(gen_time), sha))
+        if self.generations:
+            self.generation, _, self.last_sha = self.generations[-1]
+
+    def append(self, text):
+        """Records text as the next generation.
+        Args:
+            text (str): content of the file.
+        Returns:
+            int generation number.
+        """
+        data = text.encode()
+        sha = hashlib.sha1(data).hexdigest()
+        lines = text.splitlines(True)
+        if sha in self.objects:
+            kind, offset, length, base_sha = self.objects[sha]
+        else:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            if self.last_sha is not None and self.last_lines is None:
+                # first append since startup.
+                self.last_lines = self.read(self.last_sha).splitlines(True)
+            if self.last_sha is None or self.depths[self.last_sha] + 1 >= self.keyframe_interval:
+                kind, base_sha = 'full', '-'
+                payload = zlib.compress(data)
+                self.depths[sha] = 0
+            else:
+                kind, base_sha = 'delta', self.last_sha
+                payload = zlib.compress(json.dumps(make_delta(self.last_lines, lines)).encode())
+                self.depths[sha] = self.depths[base_sha] + 1
+            with open(self.path + '.pack', 'ab') as pack:
+                offset = pack.tell()
+                pack.write(payload)
+            length = len(payload)
+            self.objects[sha] = (kind, offset, length, base_sha)
+
+        self.generation += 1
+        now = time.time()
+        with open(self.path + '.idx', 'a') as idx:
+            idx.write('%d %f %s %s %d %d %s\n' % (self.generation, now, sha, kind,
+                                                 offset, length, base_sha))
+        self.generations.append((self.generation, now, sha))
+        self.last_sha = sha
+        self.last_lines = lines
+        if self.expired(now) >= self.keyframe_interval:
+            self.compact(now)
+        return self.generation
+
+    def expired(self, now):
+        """Returns:
+            the number of (oldest) generations that are no longer to be kept.
+        """
+        count = 0
+        if self.keep:
+            count = max(0, len(self.generations) - self.keep)
+        if self.max_age:
+            while count < len(self.generations) - 1 \
+                    and now - self.generations[count][1] > self.max_age:
+                count += 1
+        return count
+
+    def compact(self, now=None):
+        """Rewrites the pack & index without the expired generations.
+        The oldest generation kept becomes a full copy, and the others are deltas
+        of the previous generation as if appended again.
+        """
+        if now is None:
+            now = time.time()
+        kept = self.generations[self.expired(now):]
+        objects = {}
+        depths = {}
+        previous_sha = None
+        previous_lines = None
+        with open(self.path + '.pack.new', 'wb') as pack, \
+                open(self.path + '.idx.new', 'w') as idx:
+            for gen, gen_time, sha in kept:
+                if sha not in objects:
+                    lines = self._read_lines(sha, previous_sha, previous_lines)
+                    if previous_sha is None or depths[previous_sha] + 1 >= self.keyframe_interval:
+                        kind, base_sha = 'full', '-'
+                        payload = zlib.compress(''.join(lines).encode())
+                        depths[sha] = 0
+                    else:
+                        kind, base_sha = 'delta', previous_sha
+                        payload = zlib.compress(
+                            json.dumps(make_delta(previous_lines, lines)).encode())
+                        depths[sha] = depths[base_sha] + 1
+                    objects[sha] = (kind, pack.tell(), len(payload), base_sha)
+                    pack.write(payload)
+                    previous_sha, previous_lines = sha, lines
+                elif sha != previous_sha:
+                    previous_sha = sha
+                    previous_lines = self._read_lines(sha, None, None)
+                kind, offset, length, base_sha = objects[sha]
+                idx.write('%d %f %s %s %d %d %s\n' % (gen, gen_time, sha, kind,
+                                                      offset, length, base_sha))
+            pack.flush()
+            os.fsync(pack.fileno())
+            idx.flush()
+            os.fsync(idx.fileno())
+        os.replace(self.path + '.pack.new', self.path + '.pack')
+        os.replace(self.path + '.idx.new', self.path + '.idx')
+        self._read_index()
+
+    def read(self, sha):
+        """Reconstructs the content of an object.
+        Args:
+            sha (str)
+        Returns:
+            str
+        """
+        return ''.join(self._read_lines(sha, None, None))
+
+    def _read_lines(self, sha, known_sha, known_lines):
+        """Reconstructs the content of an object as a list of lines.
+        Args:
+            sha (str)
+            known_sha (str): an object already reconstructed, to stop at if it
+                             is in sha's chain of deltas. None if there is none.
+            known_lines (list): the lines of known_sha.
+        Returns:
+            list of str
+        """
+        chain = []
+        with open(self.path + '.pack', 'rb') as pack:
+            while True:
+                if sha == known_sha:
+                    lines = known_lines
+                    break
+                kind, offset, length, base_sha = self.objects[sha]
+                pack.seek(offset)
+                payload = zlib.decompress(pack.read(length))
+                if kind == 'full':
+                    lines = payload.decode().splitlines(True)
+                    break
+                chain.append(json.loads(payload.decode()))
+                sha = base_sha
+        for delta in reversed(chain):
+            lines = apply_delta(lines, delta)
+        return lines
+
+    def get(self, generation):
+        """Returns:
+            str content of generation.
+        """
+        for gen, _, sha in self.generations:
+            if gen == generation:
+                return self.read(sha)
+        raise KeyError('no generation %s' % generation)
+
+
+def make_delta(old, new):
+    """Creates a delta from the old to new list of lines.
+    Changes are usually in one place (a port acl), so the delta is the number of lines in
+    common at the start & end and the new lines in between.
+    Returns:
+        [prefix length, suffix length, [lines]]
+    """
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    return [prefix, suffix, new[prefix:len(new) - suffix]]
+
+
+def apply_delta(old, delta):
+    """Applies a delta from make_delta() to old list of lines.
+    Returns:
+        new list of lines.
+    """
+    prefix, suffix, lines = delta
+    return old[:prefix] + lines + old[len(old) - suffix:]
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        return
+    # pylint: disable=unbalanced-tuple-unpacking
+    path, cmd = sys.argv[1:3]
+    store = HistoryStore(path)
+    if cmd == 'list':
+        for gen, gen_time, sha in store.generations:
+            print('%d %s %s %s' % (gen, time.strftime('%Y-%m-%d %H:%M:%S',
+                                                       time.localtime(gen_time)),
+                                   sha, store.objects[sha][0]))
+    elif cmd == 'show':
+        sys.stdout.write(store.get(int(sys.argv[3])))
+    elif cmd == 'diff':
+        gen1, gen2 = int(sys.argv[3]), int(sys.argv[4])
+        sys.stdout.writelines(difflib.unified_diff(store.get(gen1).splitlines(True),
+                                                   store.get(gen2).splitlines(True),
+                                                   'generation %d' % gen1,
+                                                   'generation %d' % gen2))
+    else:
+        print(__doc__)
+
+
+if __name__ == '__main__':
+    main()
@@ -31,13 +31,20 @@ class HostapdCtrl(object):
         Returns:
             returns result of cmd.
         """
+        self.send_request(cmd)
+
+        return self.receive(size=4096)
+
+    def send_request(self, cmd):
+        """Sends a command without waiting for the result. See request().
+        Args:
+            cmd (str): command string to send.
+        """
         if self.cookie:
             cmd = 'COOKIE=%s %s' % (self.cookie, cmd)
         self.logger.debug('request is "%s"', cmd)
         self.soc.send(cmd.encode())
 
-        return self.receive(size=4096)
-
     def attach(self):
         """Sends the 'attach' command to hostapd.
         Has the effect of subscribing to hostapd's unsolicited
@@ -71,7 +78,7 @@ class HostapdCtrl(object):
         Returns:
             running config converted to dict.
         """
-        return self._to_dict(self.request('GET_CONFIG'))
+        return self.to_dict(self.request('GET_CONFIG'))
 
     def get_sta(self, mac):
         """Get MIB variables for one station
@@ -80,7 +87,7 @@ class HostapdCtrl(object):
         Returns:
             dict of station MIB
         """
-        return self._to_dict(self.request('STA %s' % mac))
+        return self.to_dict(self.request('STA %s' % mac))
 
     def all_sta(self):
         """Get MIB variables for all stations.
@@ -91,7 +98,7 @@ class HostapdCtrl(object):
         d = self.request('STA-FIRST')
         mac_addr = d.split()[0]
         data = d.split()[1:]
-        stas[mac_addr] = self._to_dict(data)
+        stas[mac_addr] = self.to_dict(data)
 
         while True:
             d = self.request('STA-NEXT %s' % mac_addr)
@@ -99,7 +106,7 @@ class HostapdCtrl(object):
                 break
             mac_addr = d.split()[0]
             data = d.split()[1:]
-            stas[mac_addr] = self._to_dict(data)
+            stas[mac_addr] = self.to_dict(data)
         return stas
 
     def deauthenticate(self, mac):
@@ -156,9 +163,15 @@ class HostapdCtrl(object):
         Returns:
             dictionary of hostapd status
         """
-        return self._to_dict(self.request('STATUS'))
+        return self.to_dict(self.request('STATUS'))
 
-    def _to_dict(self, d):
+    def to_dict(self, d):
+        """Converts the result of a command (e.g. STA) to a dict.
+        Args:
+            d (str): lines of key=value.
+        Returns:
+            dict
+        """
         self.logger.debug(d)
         dic = {}
         for s in d.split('\n'):
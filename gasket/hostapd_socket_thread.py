@@ -12,8 +12,9 @@ FAUCET_ENTERPRISE_NUMBER = 12345
 FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE = 1
 
 
-class HostapdSocketThread(threading.Thread):
-    """Stores state related to a hostapd instance.
+class HostapdSocket(object):
+    """Stores state related to a hostapd instance, and turns its messages into work.
+    Run by a HostapdSocketThread, or the asyncio runtime (see async_runtime).
     """
     logger = None
 
@@ -33,9 +34,8 @@ class HostapdSocketThread(threading.Thread):
                                                 1)
         self.work_queue = work_queue
 
-    def run(self):
-        """Main loop, waits for messages from hostapd ctl socket,
-        and processes them.
+    def init_sockets(self):
+        """Connects the request and unsolicited sockets to hostapd.
         """
         self.logger.info('about to start socket')
         if self.conf.udp:
@@ -46,67 +46,67 @@ class HostapdSocketThread(threading.Thread):
             except Exception as e:
                 self.logger.exception(e)
                 raise
+        self.logger.info('sockets initiated')
 
-        try:
-            self.logger.info('sockets initiated')
-            while not self.stop:
-                self.logger.debug('waiting for receive')
-                data = ""
-                try:
-                    data = str(self.unsolicited_sock.receive())
-                except socket.timeout:
-                    if self.request_sock.ping():
-                        # reconnect unsolicited.
-                        # should we ping or just go straight for reconnect?
-                        self.unsolicited_sock.ping()
-                    continue
-                self.logger.info('received message: %s', data)
-                if 'CTRL-EVENT-EAP-SUCCESS' in data:
-                    self.logger.info('success message')
-                    mac = data.split()[1].replace("'", '')
-                    try:
-                        sta = self.request_sock.get_sta(mac)
-                    except socket.timeout:
-                        self.logger.warning('request socket timed out while getting mib for mac: %s',
-                                            mac)
-                        continue
-
-                    if 'AccessAccept:Vendor-Specific:%d:%d' \
-                                            % (FAUCET_ENTERPRISE_NUMBER,
-                                               FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE) in sta:
-                        radius_acl_list = sta['AccessAccept:Vendor-Specific:%d:%d'
-                                              % (FAUCET_ENTERPRISE_NUMBER,
-                                                 FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE)].split(',')
-                    else:
-                        self.logger.info('AccessAccept:Vendor-Specific:%d:%d not in mib',
-                                         FAUCET_ENTERPRISE_NUMBER,
-                                         FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE)
-                        continue
-                    username = sta['dot1xAuthSessionUserName']
-                    # and add mac, username, radius_acl_list to work queue.
-                    self.logger.info('work about to be given to queue')
-                    self.work_queue.put(work_item.AuthWorkItem(mac,
-                                                               username,
-                                                               radius_acl_list,
-                                                               self.conf.name))
-                    self.logger.info('work given to queue')
-                elif 'AP-STA-DISCONNECTED' in data:
-                    self.logger.info('%s disconnected message', data)
-                    mac = data.split()[1].replace("'", '')
-                    # and add mac to the work queue for deauth. maybe add which hostapd it came from
-                    self.work_queue.put(work_item.DeauthWorkItem(mac, self.conf.name))
-                else:
-                    self.logger.info('unknown message %s', data)
-        except OSError as e:
-            if self.stop:
-                self.logger.info('Bad file descriptor after shutdown')
+    def check_connection(self):
+        """Called when no message has arrived within the timeout.
+        Pings hostapd, reconnecting if it does not respond.
+        """
+        if self.request_sock.ping():
+            # reconnect unsolicited.
+            # should we ping or just go straight for reconnect?
+            self.unsolicited_sock.ping()
+
+    def handle_message(self, data):
+        """Adds the work for a message from the unsolicited socket to the work queue.
+        Args:
+            data (str): message from hostapd.
+        """
+        self.logger.info('received message: %s', data)
+        if 'CTRL-EVENT-EAP-SUCCESS' in data:
+            self.logger.info('success message')
+            mac = data.split()[1].replace("'", '')
+            try:
+                sta = self.request_sock.get_sta(mac)
+            except socket.timeout:
+                self.logger.warning('request socket timed out while getting mib for mac: %s',
+                                    mac)
                 return
-            self.logger.error('OSError exception in run. self.stop has not been set.')
-            self.logger.exception(e)
-        except Exception as e:
-            self.logger.error('exception in run.')
-            self.logger.exception(e)
+
+            self.auth_success(mac, sta)
+        elif 'AP-STA-DISCONNECTED' in data:
+            self.logger.info('%s disconnected message', data)
+            mac = data.split()[1].replace("'", '')
+            # and add mac to the work queue for deauth. maybe add which hostapd it came from
+            self.work_queue.put(work_item.DeauthWorkItem(mac, self.conf.name))
+        else:
+            self.logger.info('unknown message %s', data)
+
+    def auth_success(self, mac, sta):
+        """Adds the authentication work for a host that hostapd has authenticated.
+        Args:
+            mac (str)
+            sta (dict): hostapd's STA MIB for mac.
+        """
+        if 'AccessAccept:Vendor-Specific:%d:%d' \
+                                % (FAUCET_ENTERPRISE_NUMBER,
+                                   FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE) in sta:
+            radius_acl_list = sta['AccessAccept:Vendor-Specific:%d:%d'
+                                  % (FAUCET_ENTERPRISE_NUMBER,
+                                     FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE)].split(',')
+        else:
+            self.logger.info('AccessAccept:Vendor-Specific:%d:%d not in mib',
+                             FAUCET_ENTERPRISE_NUMBER,
+                             FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE)
             return
+        username = sta['dot1xAuthSessionUserName']
+        # and add mac, username, radius_acl_list to work queue.
+        self.logger.info('work about to be given to queue')
+        self.work_queue.put(work_item.AuthWorkItem(mac,
+                                                   username,
+                                                   radius_acl_list,
+                                                   self.conf.name))
+        self.logger.info('work given to queue')
 
     def kill(self):
         self.stop = True
@@ -145,3 +145,35 @@ class HostapdSocketThread(threading.Thread):
                                                                      self.conf.unsolicited_timeout,
                                                                      self.logger)
         self.logger.debug('initiated UNIX socket.')
+
+
+class HostapdSocketThread(HostapdSocket, threading.Thread):
+    """Thread that waits for messages from a hostapd instance.
+    """
+
+    def run(self):
+        """Main loop, waits for messages from hostapd ctl socket,
+        and processes them.
+        """
+        self.init_sockets()
+
+        try:
+            while not self.stop:
+                self.logger.debug('waiting for receive')
+                data = ""
+                try:
+                    data = str(self.unsolicited_sock.receive())
+                except socket.timeout:
+                    self.check_connection()
+                    continue
+                self.handle_message(data)
+        except OSError as e:
+            if self.stop:
+                self.logger.info('Bad file descriptor after shutdown')
+                return
+            self.logger.error('OSError exception in run. self.stop has not been set.')
+            self.logger.exception(e)
+        except Exception as e:
+            self.logger.error('exception in run.')
+            self.logger.exception(e)
+            return
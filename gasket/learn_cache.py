@@ -0,0 +1,85 @@
+"""Cache of where macs were last learnt, to drop the repeated L2_LEARN events faucet
+sends for a mac that has not moved, before they become work.
+"""
+import collections
+import time
+
+
+class LearnCache(object):
+    """Bounded (LRU) cache of mac : (dp_id, port, vid, time learnt).
+    Evicts the mac least recently learnt (or dropped as a duplicate).
+    A learn is a duplicate if it is the mac's last location and was seen less than ttl ago.
+    Learns at another location are not duplicates, as they change the host's learn ports.
+    Used by one thread (the RabbitMQ one).
+    """
+
+    ttl = 60
+    max_size = 100000
+
+    # mac : (dp_id, port, vid, time)
+    entries = None
+    # (dp_id, port) : set of macs last learnt on it.
+    port_macs = None
+
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    def __init__(self, ttl=60, max_size=100000):
+        """
+        Args:
+            ttl (int): seconds to drop duplicate learns for.
+            max_size (int): max number of macs to remember.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.port_macs = {}
+
+    def is_duplicate(self, dp_id, port, vid, mac):
+        """Checks if a learn is a duplicate, and remembers it if not.
+        Args:
+            dp_id (int)
+            port (int)
+            vid (int)
+            mac (str)
+        Returns:
+            True if the learn can be dropped.
+        """
+        now = time.time()
+        entry = self.entries.get(mac)
+        if entry is not None and entry[:3] == (dp_id, port, vid) and now - entry[3] < self.ttl:
+            self.entries.move_to_end(mac)
+            self.hits += 1
+            return True
+        self.misses += 1
+        if entry is not None:
+            self._forget(mac)
+        self.entries[mac] = (dp_id, port, vid, now)
+        self.port_macs.setdefault((dp_id, port), set()).add(mac)
+        if len(self.entries) > self.max_size:
+            self._forget(next(iter(self.entries)))
+            self.evictions += 1
+        return False
+
+    def forget_port(self, dp_id, port):
+        """Forgets the macs learnt on a port, e.g. because it has changed status,
+        so the next learn of each is not a duplicate.
+        """
+        for mac in self.port_macs.pop((dp_id, port), ()):
+            self.entries.pop(mac, None)
+
+    def _forget(self, mac):
+        dp_id, port, _, _ = self.entries.pop(mac)
+        macs = self.port_macs.get((dp_id, port))
+        if macs is not None:
+            macs.discard(mac)
+            if not macs:
+                del self.port_macs[(dp_id, port)]
+
+    def stats(self):
+        """Returns:
+            dict of the cache's counters.
+        """
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
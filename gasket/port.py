@@ -39,6 +39,8 @@ class Port(gasket_conf.GasketConf):
         """
         super(Port, self).__init__(_id, conf, dpid=dp.dp_id)
         self.datapath = dp
+        self.learnt_hosts = set()
+        self.authed_hosts = set()
 
 
     def set_defaults(self):
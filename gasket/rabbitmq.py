@@ -16,11 +16,15 @@ class RabbitMQ(threading.Thread):
     """
     channel = None
     work_queue = None
+    reload_waiter = None
+    learn_cache = None
     logger = None
 
-    def __init__(self, work_queue, logger_location):
+    def __init__(self, work_queue, logger_location, reload_waiter=None, learn_cache=None):
         super().__init__()
         self.work_queue = work_queue
+        self.reload_waiter = reload_waiter
+        self.learn_cache = learn_cache
         self.logger = auth_app_utils.get_logger('rabbitmq',
                                                 logger_location,
                                                 logging.DEBUG,
@@ -71,6 +75,8 @@ class RabbitMQ(threading.Thread):
                 port_no = pc['port_no']
                 reason = pc['reason']
                 status = pc['status']
+                if self.learn_cache:
+                    self.learn_cache.forget_port(dp_id, port_no)
                 self.work_queue.put(PortChangeWorkItem(dp_name, dp_id, port_no, reason, status))
 
             elif 'L2_LEARN' in d:
@@ -80,8 +86,20 @@ class RabbitMQ(threading.Thread):
                 eth_src = l2l['eth_src']
                 l3_src_ip = l2l['l3_src_ip']
 
+                if self.learn_cache and self.learn_cache.is_duplicate(dp_id, port_no,
+                                                                      vid, eth_src):
+                    # host has not moved.
+                    continue
                 self.work_queue.put(L2LearnWorkItem(dp_name, dp_id,
                                                     port_no, vid,
                                                     eth_src, l3_src_ip))
+
+            elif 'CONFIG_CHANGE' in d:
+                # faucet has (re)loaded its config.
+                # faucet sends one per datapath, so a reload may notify more than once.
+                # ReloadWaiter only confirms reloads by the count when there is one datapath.
+                if self.reload_waiter:
+                    self.reload_waiter.notify()
+
     def kill(self):
         self.channel.close()
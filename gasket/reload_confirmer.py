@@ -0,0 +1,242 @@
+"""Signals faucet to reload its config and confirms that it has,
+without blocking the worker thread.
+Reloads are detected from faucet's CONFIG_CHANGE events (see ReloadWaiter),
+falling back to faucet's prometheus reload count if no event arrives,
+or if there is more than one datapath.
+"""
+import logging
+import signal
+import threading
+import time
+
+from gasket import auth_app_utils
+
+
+class ReloadWaiter(object):
+    """Counts faucet CONFIG_CHANGE events (as notified by the rabbitmq thread),
+    and allows waiting for the next one.
+    faucet sends one event per datapath, so with more than one datapath an event
+    from an earlier reload can arrive after a later signal. The count is then only
+    used to wake the confirmer, and reloads are confirmed by the prometheus count.
+    """
+
+    count = 0
+    # True once an event has been received, i.e. faucet events are being delivered.
+    active = False
+    # number of datapaths faucet is configured with.
+    dps = 1
+
+    def __init__(self, dps=1):
+        self.cond = threading.Condition()
+        self.dps = dps
+
+    def counts_reloads(self):
+        """Returns:
+            True if the event count can be compared to confirm a reload.
+        """
+        return self.active and self.dps <= 1
+
+    def notify(self):
+        """Called when faucet has reloaded its config."""
+        with self.cond:
+            self.count += 1
+            self.active = True
+            self.cond.notify_all()
+
+    def wait(self, count, timeout):
+        """Waits until more than count events have been received.
+        Args:
+            count (int): event count to wait to exceed.
+            timeout (float): seconds.
+        Returns:
+            True if an event has arrived, False if timed out.
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: self.count > count, timeout)
+
+
+class Generation(object):
+    """A version of the faucet config that has been written, and needs faucet to reload it.
+    """
+    number = None
+    # time the generation was submitted.
+    created = None
+    # list of (action, username, mac) in this generation.
+    changes = None
+    # faucet reload count (from prometheus) before the signal was sent.
+    # None if it has not been needed.
+    start_count = None
+    # ReloadWaiter count before the signal was sent.
+    start_events = None
+    # time the (last) signal was sent.
+    sent_time = None
+    # number of signals sent.
+    attempts = 0
+    confirmed = False
+    failed = False
+
+    def __init__(self, number, changes):
+        self.number = number
+        self.changes = changes
+        self.created = time.time()
+
+    def __str__(self):
+        return 'Generation %d, %d changes' % (self.number, len(self.changes))
+
+
+class ReloadConfirmer(threading.Thread):
+    """Thread that sends the SIGHUP for each submitted generation and resolves outstanding
+    generations once faucet reports that it has reloaded.
+    If faucet does not reload within the timeout the signal is resent (retries times),
+    after that the generation is failed.
+    """
+
+    rule_man = None
+    logger = None
+    timeout = 20
+    retries = 1
+    poll_interval = 0.05
+    # seconds to wait for a CONFIG_CHANGE event before also checking prometheus.
+    event_timeout = 1
+    stop = False
+
+    waiter = None
+
+    outstanding = None
+    # generations that have been submitted but not signalled yet.
+    unsent = None
+
+    def __init__(self, rule_man, waiter, logger_location, timeout=20, retries=1,
+                 poll_interval=0.05):
+        super().__init__()
+        self.daemon = True
+        self.rule_man = rule_man
+        self.waiter = waiter
+        self.logger = auth_app_utils.get_logger('reload_confirmer',
+                                                logger_location,
+                                                logging.DEBUG,
+                                                1)
+        self.timeout = timeout
+        self.retries = retries
+        self.poll_interval = poll_interval
+        self.outstanding = []
+        self.unsent = []
+        self.cond = threading.Condition()
+
+    def submit(self, generation):
+        """Queues a generation to be signalled & confirmed. Does not block.
+        Args:
+            generation (Generation): generation that has been written to file.
+        """
+        with self.cond:
+            self.unsent.append(generation)
+            self.cond.notify()
+
+    def run(self):
+        self.logger.info('running')
+        while not self.stop:
+            with self.cond:
+                while not self.stop and not self.unsent and not self.outstanding:
+                    self.cond.wait()
+            events = self.waiter.count
+            try:
+                self.poll()
+            except Exception as e:
+                self.logger.exception(e)
+            # wakes as soon as faucet sends an event.
+            self.waiter.wait(events, self.poll_interval)
+
+    def poll(self):
+        """Signals faucet for any newly submitted generations,
+        and resolves outstanding generations against faucet's reload count.
+        """
+        with self.cond:
+            unsent = self.unsent
+            self.unsent = []
+        if unsent:
+            # faucet will read the latest file, so only one signal is needed for all of them.
+            self._send(unsent)
+
+        outstanding = self.outstanding
+        if not outstanding:
+            return
+        events = self.waiter.count
+        count = None
+        now = time.time()
+        newest_confirmed = None
+        for generation in outstanding:
+            if self.waiter.counts_reloads() and events > generation.start_events:
+                newest_confirmed = generation
+            elif generation.start_count is not None \
+                    or now - generation.sent_time > self.event_timeout:
+                # no event (yet), fall back to prometheus.
+                if count is None:
+                    count = self.rule_man.get_faucet_reload_count()
+                if generation.start_count is None:
+                    # expected an event. if faucet has already reloaded we will not see it
+                    # change, and the signal will be resent after the timeout.
+                    generation.start_count = count
+                elif count > generation.start_count:
+                    newest_confirmed = generation
+        if newest_confirmed:
+            # faucet has reloaded a file at least as new as the newest confirmed.
+            while outstanding and outstanding[0].number <= newest_confirmed.number:
+                generation = outstanding.pop(0)
+                generation.confirmed = True
+                self.rule_man.reload_resolved(generation)
+
+        now = time.time()
+        timed_out = [g for g in outstanding if now - g.sent_time > self.timeout]
+        if not timed_out:
+            return
+        retry = []
+        for generation in timed_out:
+            if generation.attempts > self.retries:
+                self.logger.error('%s: faucet did not reload after %d signals',
+                                  generation, generation.attempts)
+                outstanding.remove(generation)
+                generation.failed = True
+                self.rule_man.reload_resolved(generation)
+            else:
+                retry.append(generation)
+        if retry:
+            self.logger.warning('faucet has not reloaded within %d seconds, resending signal',
+                                self.timeout)
+            self._send(retry)
+
+    def _send(self, generations):
+        """Sends a SIGHUP to faucet for generations.
+        If it cannot be sent they are failed, so their changes are committed again later.
+        """
+        start_events = self.waiter.count
+        start_count = None
+        try:
+            if not self.waiter.counts_reloads():
+                # cannot confirm from the events, so need the prometheus count to compare to.
+                start_count = self.rule_man.get_faucet_reload_count()
+            self.rule_man.send_signal(signal.SIGHUP)
+        except Exception as e:
+            self.logger.error('cannot signal faucet for %s: %s',
+                              ', '.join(str(g) for g in generations), e)
+            for generation in generations:
+                if generation in self.outstanding:
+                    self.outstanding.remove(generation)
+                generation.attempts += 1
+                generation.failed = True
+                self.rule_man.reload_resolved(generation)
+            return
+        now = time.time()
+        for generation in generations:
+            generation.start_count = start_count
+            generation.start_events = start_events
+            generation.sent_time = now
+            generation.attempts += 1
+            if generation not in self.outstanding:
+                self.outstanding.append(generation)
+        self.logger.info('signal sent for %s', ', '.join(str(g) for g in generations))
+
+    def kill(self):
+        """Stops the thread."""
+        with self.cond:
+            self.stop = True
+            self.cond.notify()
@@ -3,23 +3,118 @@ yaml keys "_authport_*, and values "_usermac_" are currently used for replacing
 as discovered at runtime.
  Switchport (_authport_) that an authenticated user (_usermac_) has authenticated on & with.
 
-TODO maybe make this an interface for yaml or db generator subclasses.
+See sqlite_rule_generator for a database backed subclass.
 """
-# pytype: disable=pyi-error
-import yaml
+import collections
+import os
+
+from gasket import yaml_utils
+
+
+USER_MAC = '_user-mac_'
+USER_NAME = '_user-name_'
+AUTH_PORT = '_authport_'
+
+
+def copy_obj(obj):
+    """Copies the dicts and lists of a parsed yaml object.
+    Faster than copy.deepcopy() as the rest (str, int, ...) are immutable.
+    """
+    if isinstance(obj, dict):
+        return {k: copy_obj(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [copy_obj(v) for v in obj]
+    return obj
+
+
+def make_template(rule):
+    """Creates a template from a rule.
+    Args:
+        rule (dict): the contents of a 'rule'.
+    Returns:
+        tuple of (rule, keys with value _user-mac_, keys with value _user-name_).
+        The rule must not be modified, see fill_template().
+    """
+    mac_keys = tuple(k for k, v in rule.items() if v == USER_MAC)
+    name_keys = tuple(k for k, v in rule.items() if v == USER_NAME)
+    return (copy_obj(rule), mac_keys, name_keys)
+
+
+def fill_template(template, username, mac, shared_blocks=False):
+    """Creates a rule for a user from a template.
+    Args:
+        template (tuple): see make_template().
+        username (str)
+        mac (str)
+        shared_blocks (bool): True to share the template's nested values (e.g. 'actions')
+                              with the new rule, rather than copy them. They must not be modified.
+    Returns:
+        new {'rule': rule} dict.
+    """
+    rule, mac_keys, name_keys = template
+    r = dict(rule) if shared_blocks else copy_obj(rule)
+    for k in mac_keys:
+        r[k] = mac
+    for k in name_keys:
+        r[k] = username
+    return {'rule': r}
+
+
+def iter_rules(objs, logger):
+    """Finds the rules of a port acl in the rules config.
+    Args:
+        objs (list): the port acl, rules and lists of rules (yaml aliases).
+        logger
+    Yields:
+        the contents of each 'rule'.
+    """
+    for obj in objs:
+        if isinstance(obj, dict) and 'rule' in obj:
+            yield obj['rule']
+        elif isinstance(obj, list):
+            for y in obj:
+                if isinstance(y, dict):
+                    # list of dicts
+                    for _, rule in list(y.items()):
+                        yield rule
+                else:
+                    logger.warning('list of unrecognised objects')
+                    logger.warning('child type: %s' % type(y))
+                    logger.warning('list object: %s' % obj)
+        else:
+            logger.warning('obj is unrecongnised type %s', type(obj))
 
 
 class RuleGenerator(object):
     """Object for gernerating rules from a yaml file.
+    The file is parsed once (and again only when it changes) into templates,
+    that the rules for each user are created from.
     """
 
     yaml_file = ""
     conf = None
     logger = None
+    # aclname : list of (port acl name, list of templates). See make_template().
+    templates = None
+    # (inode, mtime, size) of the rules file when it was loaded.
+    file_stat = None
 
-    def __init__(self, rule_file, logger):
-        self.reload(rule_file)
+    # LRU of (tuple of acl_list, auth_port_acl) : expansion. See expand().
+    cache = None
+    # max number of expansions to cache. 0 disables the cache.
+    cache_size = 0
+    cache_hits = 0
+    cache_misses = 0
+    cache_evictions = 0
+    # see fill_template().
+    shared_blocks = False
+
+    def __init__(self, rule_file, logger, cache_size=0, shared_blocks=False):
         self.logger = logger
+        self.cache_size = cache_size
+        self.shared_blocks = shared_blocks
+        self.cache = collections.OrderedDict()
+        self.reload(rule_file)
 
     def get_rules(self, username, auth_port_acl, mac, acl_list):
         """Gets Faucet ACL rules for the specified user.
@@ -32,66 +127,117 @@ class RuleGenerator(object):
         Returns:
             Dictionary of port_acl names to list of rules.
         """
-        # if we don't reload the values that we will want to swap
-        # may already be filled if the user has logged on already.
-
-        # what about doing a copy or deepcopy?
-        # and only do a full reload when file has actually changed?
-        self.reload(self.yaml_file)
+        self.check_reload()
 
         rules = dict()
-        for aclname in acl_list:
-            if aclname in list(self.conf['acls']):
-                for portacl in list(self.conf['acls'][aclname].keys()):
-                    if portacl not in rules:
-                        rules[portacl] = []
-                    for obj in self.conf['acls'][aclname][portacl]:
-                        if isinstance(obj, dict) and 'rule' in obj:
-                            r = obj["rule"]
-                            for k, v in list(r.items()):
-                                if v == "_user-mac_":
-                                    r[k] = mac
-                                if v == "_user-name_":
-                                    r[k] = username
-                            d = dict()
-                            d["rule"] = r
-                            rules[portacl].append(d)
-                        elif isinstance(obj, list):
-                            for y in obj:
-                                if isinstance(y, dict):
-                                    # list of dicts
-                                    for _, rule in list(y.items()):
-                                        r = rule
-                                        for k, v in list(r.items()):
-                                            if v == "_user-mac_":
-                                                r[k] = mac
-                                            if v == "_user-name_":
-                                                r[k] = username
-                                        d = dict()
-                                        d["rule"] = r
-                                        rules[portacl].append(d)
-                                else:
-                                    self.logger.warning('list of unrecognised objects')
-                                    self.logger.warning('child type: %s' % type(y))
-                                    self.logger.warning('list object: %s' % obj)
-
-                        else:
-                            self.logger.warning('obj is unrecongnised type %s', type(obj))
-                    if portacl == "_authport_":
-                        # rename the port acl to the one the user authenticated on.
-                        temp = rules[portacl]
-                        del rules[portacl]
-                        if auth_port_acl in rules:
-                            rules[auth_port_acl].extend(temp)
-                        else:
-                            rules[auth_port_acl] = temp
+        for portacl, templates in self.get_expansion(acl_list, auth_port_acl):
+            rules[portacl] = [fill_template(template, username, mac, self.shared_blocks)
+                              for template in templates]
         return rules
 
+    def get_expansion(self, acl_list, auth_port_acl):
+        """Gets the expansion from the cache, or creates (and caches) it.
+        Args:
+            acl_list (list of str)
+            auth_port_acl (str)
+        Returns:
+            see expand().
+        """
+        if not self.cache_size:
+            return self.expand(acl_list, auth_port_acl)
+        key = (tuple(acl_list), auth_port_acl)
+        expansion = self.cache.get(key)
+        if expansion is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(key)
+            return expansion
+        self.cache_misses += 1
+        expansion = self.expand(acl_list, auth_port_acl)
+        self.cache[key] = expansion
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+            self.cache_evictions += 1
+        return expansion
+
+    def expand(self, acl_list, auth_port_acl):
+        """Finds the templates for the acls in acl_list, merged by port acl.
+        Args:
+            acl_list (list of str): names of acls (in order of highest priority to lowest).
+            auth_port_acl (str): the port acl name of the port authenticated on.
+        Returns:
+            tuple of (port acl name, tuple of templates), in the order the rules are applied.
+        """
+        expansion = dict()
+        for aclname in acl_list:
+            acl_templates = self.get_acl_templates(aclname)
+            if acl_templates is None:
+                continue
+            for portacl, templates in acl_templates:
+                if portacl == AUTH_PORT:
+                    # rename the port acl to the one the user authenticated on.
+                    portacl = auth_port_acl
+                expansion.setdefault(portacl, []).extend(templates)
+        return tuple((portacl, tuple(templates)) for portacl, templates in expansion.items())
+
+    def cache_stats(self):
+        """Returns:
+            dict of the expansion cache's counters.
+        """
+        return {'size': len(self.cache), 'hits': self.cache_hits,
+                'misses': self.cache_misses, 'evictions': self.cache_evictions}
+
+    def get_acl_templates(self, aclname):
+        """Args:
+            aclname (str)
+        Returns:
+            list of (port acl name, list of templates) for the acl. None if there is no acl.
+        """
+        return self.templates.get(aclname)
+
+    def compile(self, conf):
+        """Creates the templates for each acl in the rules config.
+        Args:
+            conf (dict): parsed rules file.
+        Returns:
+            dict of aclname : list of (port acl name, list of templates)
+        """
+        templates = {}
+        for aclname, acl in (conf.get('acls') or {}).items():
+            acl_templates = []
+            for portacl, objs in acl.items():
+                port_templates = [make_template(rule) for rule in iter_rules(objs, self.logger)]
+                acl_templates.append((portacl, port_templates))
+            templates[aclname] = acl_templates
+        return templates
+
+    def check_reload(self):
+        """Reloads the rule file if it has changed since it was loaded.
+        """
+        try:
+            stat = os.stat(self.yaml_file)
+        except OSError as e:
+            self.logger.warning('unable to stat rules file: %s', e)
+            return
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self.file_stat:
+            self.logger.info('rules file %s has changed, reloading', self.yaml_file)
+            try:
+                self.reload(self.yaml_file)
+            except Exception as e:
+                # keep using the old rules.
+                self.logger.exception(e)
+
     def reload(self, rule_file):
         """(Re)loads the rule yaml file.
         Args:
             rule_file: path to file.
         """
         self.yaml_file = rule_file
-        self.conf = yaml.load(open(rule_file, "r"))
-
+        stat = os.stat(rule_file)
+        # stat before reading, so a change while reading is picked up next time.
+        self.file_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        conf = yaml_utils.load_file(rule_file)
+        self.templates = self.compile(conf)
+        self.conf = conf
+        if self.cache:
+            self.logger.info('clearing rule cache %s', self.cache_stats())
+            self.cache.clear()
@@ -1,19 +1,29 @@
 """Handles the construction of the Faucet ACL configuration from the authentication application."""
 # pytype: disable=pyi-error
+import hashlib
+import json
 import logging
 import os
-import re
 import shutil
-import signal
 import sys
+import threading
 import time
-# pytype: disable=pyi-error
-import yaml
 
 import requests
 
+from gasket.auth_journal import AuthJournal
+from gasket.backup import Backups
+from gasket.config_writer import ConfigWriter
+from gasket.history import HistoryStore
+from gasket.reload_confirmer import Generation, ReloadConfirmer, ReloadWaiter
 from gasket.rule_generator import RuleGenerator
+from gasket.sqlite_rule_generator import SQLiteRuleGenerator
 from gasket import auth_app_utils
+from gasket import yaml_utils
+
+
+RELOAD_COUNT_METRIC = 'faucet_config_reload_requests'
+
 
 def main():
     """Create a default base config and the initial Faucet ACL yaml file,
@@ -34,15 +44,26 @@ def create_base_faucet_acls(input_f, output_f):
         input_f (str): input filename (base config)
         output_f (str): output filename (faucet-acl.yaml)
     """
-    with open(input_f) as f:
-        base = yaml.safe_load(f)
+    base = yaml_utils.load_file(input_f)
     logging.basicConfig(filename='rule_man_base.log', level=logging.DEBUG)
     final = create_faucet_acls(base, logger=logging)
     write_yaml(final, output_f, True)
 
 
+def strip_rule(rule):
+    """Returns a copy of rule without the gasket only '_mac_' & '_name_' keys.
+    The original rule is left untouched so it can still be matched on deauthentication.
+    Args:
+        rule (dict): acl rule.
+    Returns:
+        new dict.
+    """
+    return {k: v for k, v in rule.items() if k not in ('_mac_', '_name_')}
+
+
 def create_faucet_acls(doc, logger):
     """Creates a yaml object that represents faucet acls.
+    doc is not modified.
     Args:
         doc (yaml object): yaml dict. containing the pre-faucet version of the
                             acls.
@@ -53,58 +74,103 @@ def create_faucet_acls(doc, logger):
     final_acls = final['acls']
 
     for acl_name, acl in list(doc['acls'].items()):
-        seq = []
-        for obj in acl:
-            if isinstance(obj, dict) and 'rule' in obj:
-                # rule
-                for _, rule in list(obj.items()):
-                    # TODO is this a pointless for loop? instead do rule = obj['rule']
-                    # TODO can thes ifs by made a function as reused?
-                    new_rule = {}
-                    new_rule['rule'] = rule
-                    if '_mac_' in rule:
-                        del rule['_mac_']
-                    if '_name_' in rule:
-                        del rule['_name_']
-                    seq.append(new_rule)
-            elif isinstance(obj, dict):
-                #alias
-                for name, l in list(obj.items()):
-                    for rule in l:
-                        r = rule['rule']
-                        if '_mac_' in r:
-                            del r['_mac_']
-                        if '_name_' in r:
-                            del r['_name_']
-                        seq.append(rule)
-            elif isinstance(obj, list):
-                for y in obj:
-                    if isinstance(y, dict):
-                        # list of dicts
-                        for _, rule in list(y.items()):
-                            new_rule = {}
-                            new_rule['rule'] = rule
-                            if '_mac_' in rule:
-                                del rule['_mac_']
-                            if '_name_' in rule:
-                                del rule['_name_']
-                            seq.append(new_rule)
-                    else:
-                        logger.warning('list of unrecognised objects')
-                        logger.warning('child type: %s' % type(y))
-                        logger.warning('list object: %s' % obj)
-            elif isinstance(obj, str):
-                # this is likey just a 'flag' used to mark position to insert the rules when authed
-                if obj == 'authed-rules':
-                    continue
+        final_acls[acl_name] = compile_acl(acl, logger)
+    return final
+
+
+def compile_acl(acl, logger):
+    """Creates the faucet version of a single port acl.
+    acl is not modified.
+    Args:
+        acl (list): pre-faucet version of the acl from the base config.
+    Returns: list of faucet rules.
+    """
+    seq = []
+    for obj in acl:
+        if isinstance(obj, dict) and 'rule' in obj:
+            # rule
+            seq.append({'rule': strip_rule(obj['rule'])})
+        elif isinstance(obj, dict):
+            #alias
+            for name, l in list(obj.items()):
+                for rule in l:
+                    seq.append({'rule': strip_rule(rule['rule'])})
+        elif isinstance(obj, list):
+            for y in obj:
+                if isinstance(y, dict):
+                    # list of dicts
+                    for _, rule in list(y.items()):
+                        seq.append({'rule': strip_rule(rule)})
                 else:
-                    logger.warning('illegal string %s', obj)
+                    logger.warning('list of unrecognised objects')
+                    logger.warning('child type: %s' % type(y))
+                    logger.warning('list object: %s' % obj)
+        elif isinstance(obj, str):
+            # this is likey just a 'flag' used to mark position to insert the rules when authed
+            if obj == 'authed-rules':
+                continue
             else:
-                logger.warning('Object type %s not recognised', type(obj))
-                logger.warning('Object: %s', obj)
+                logger.warning('illegal string %s', obj)
+        else:
+            logger.warning('Object type %s not recognised', type(obj))
+            logger.warning('Object: %s', obj)
+    return seq
 
-        final_acls[acl_name] = seq
-    return final
+
+def dump_acl_fragment(acl_name, acl, fmt='yaml', anchor_prefix=None):
+    """Serialises a single compiled port acl, as it would appear in the faucet acl file.
+    Args:
+        acl_name (str): port acl name.
+        acl (list): compiled faucet acl.
+        fmt (str): 'yaml' or 'json'.
+        anchor_prefix (str): yaml only. If not None objects that are in the acl more than once
+                             (see RuleManager.share_blocks()) are written once and aliased.
+                             Must be unique to the acl in the file, so the anchors are.
+    Returns:
+        str. text to be a child of the top level 'acls'.
+    """
+    if fmt == 'json':
+        return json.dumps(acl_name) + ':' + json.dumps(acl, separators=(',', ':'))
+    if anchor_prefix is not None:
+        text = yaml_utils.dump({acl_name: acl}, anchor_prefix=anchor_prefix)
+    else:
+        text = yaml_utils.dump({acl_name: acl}, ignore_aliases=True)
+    return ''.join('  ' + line for line in text.splitlines(True))
+
+
+def assemble_acls(fragments, fmt='yaml'):
+    """Joins acl fragments into the text of a faucet acl file.
+    Fragments are ordered by acl name, the same as yaml.dump sorts them.
+    Args:
+        fragments (dict): acl name : text from dump_acl_fragment().
+        fmt (str): 'yaml' or 'json'. must be the same as the fragments.
+    Returns:
+        str
+    """
+    names = sorted(fragments)
+    if fmt == 'json':
+        return '{"acls":{' + ','.join(fragments[name] for name in names) + '}}\n'
+    if not fragments:
+        return 'acls: {}\n'
+    return 'acls:\n' + ''.join(fragments[name] for name in names)
+
+
+def load_config(filename, fmt='yaml'):
+    """Loads a yaml or json file.
+    Args:
+        filename (str)
+        fmt (str): 'json' tries the faster json parser first, falling back to yaml
+                   if the file is not json (e.g. it was written by hand).
+    Returns:
+        loaded object.
+    """
+    with open(filename) as f:
+        if fmt == 'json':
+            try:
+                return json.load(f)
+            except ValueError:
+                f.seek(0)
+        return yaml_utils.load(f)
 
 
 def write_yaml(yml, filename, ignore_aliases=False):
@@ -116,14 +182,8 @@ def write_yaml(yml, filename, ignore_aliases=False):
                                 and object written out in full.
                                 False if aliases can be used.
     """
-    if ignore_aliases:
-        noalias_dumper = yaml.dumper.SafeDumper
-        noalias_dumper.ignore_aliases = lambda self, data: True
-        with open(filename, 'w') as f:
-            yaml.dump(yml, f, default_flow_style=False, Dumper=noalias_dumper)
-    else:
-        with open(filename, 'w') as f:
-            yaml.dump(yml, f, default_flow_style=False)
+    with open(filename, 'w') as f:
+        yaml_utils.dump(yml, f, ignore_aliases)
 
 
 class RuleManager(object):
@@ -132,53 +192,272 @@ class RuleManager(object):
     """
 
     logger = None
+    prom_scraper = None
+    # in memory copy of the base config. This is authoritative,
+    # the base file is only written to (except when reloaded).
+    base = None
+    base_changed = False
+
+    # indexes of the base 'aauth' entries.
+    # mac : {aauth key : set of _name_ (None if no _name_) of rules with that _mac_}
+    mac_index = None
+    # username : set of aauth keys with rules that have that _name_ and no _mac_
+    name_index = None
+    # aauth key : set of port acl names that the entry is in.
+    port_acl_index = None
+    # (port acl name, aauth key) of the entries removed since the last commit.
+    # They are left in the port acl with no rules, so if the key is added again
+    # its rules go back in the same place. See purge_removed().
+    removed_entries = None
+    # the authenticated hosts are also kept in the base as 'sessions',
+    # mac : {'username': str, 'dp_name': str, 'port': int, 'acl_list': list of str}
+    # so the AuthApp can rebuild its hosts after a restart. See get_sessions().
+
+    # port acl name : compiled faucet acl (list of rules).
+    compiled_acls = None
+    # names of port acls that have changed since they were last compiled.
+    dirty_acls = None
+    # port acl name : serialised compiled acl. See dump_acl_fragment().
+    acl_fragments = None
+    # canonical json of a block : the block. See share_blocks().
+    blocks = None
+    # port acl name : short prefix for the yaml anchors in its fragment.
+    anchor_prefixes = None
+
+    # changes (action, username, mac) that have been made to the base,
+    # but not yet sent to faucet.
+    pending = None
+    # time the first of the pending changes was made.
+    batch_start = None
+    # seconds to collect changes for before reloading faucet. 0 reloads on every change.
+    batch_window = 0
+    # max number of changes in a batch. 0 for no limit.
+    batch_size = 0
+    # seconds to wait before committing again, after writing the files has failed.
+    commit_retry_interval = 1
+    # time the pending changes can be committed again, after a failed commit.
+    commit_retry_time = 0
+
+    # batch metrics
+    batches = 0
+    batched_changes = 0
+    last_batch_size = 0
+    last_reload_latency = None
+    failed_reloads = 0
+    # commits that did not change the faucet acls, so faucet was not reloaded.
+    suppressed_reloads = 0
+    # sha1 of the faucet acl file last written.
+    faucet_acl_digest = None
+
+    confirmer = None
+    reload_waiter = None
+    generation = 0
+    # mac : number of the newest generation with a change for mac that faucet
+    # has not confirmed reloading yet.
+    unconfirmed = None
+    # changes of the generations faucet failed to reload, to be committed again.
+    failed_changes = None
+    # generations failed since faucet last reloaded one.
+    consecutive_failed_reloads = 0
+    # time the failed changes can be committed again. See requeue_failed().
+    retry_time = 0
 
     def __init__(self, config, logger):
         self.config = config
         self.logger = logger
-        self.rule_gen = RuleGenerator(self.config.rules, self.logger)
+        self.shared_blocks = self.config.shared_blocks
+        rule_gen_class = RuleGenerator
+        if self.config.rules_backend == 'sqlite':
+            rule_gen_class = SQLiteRuleGenerator
+        self.rule_gen = rule_gen_class(self.config.rules, self.logger,
+                                       cache_size=self.config.rules_cache_size,
+                                       shared_blocks=self.shared_blocks)
         self.base_filename = self.config.base_filename
+        self.base_format = self.config.base_config_format
         self.faucet_acl_filename = self.config.acl_config_file
-
-    def add_to_base_acls(self, filename, rules, user, mac):
-        '''Adds rules to the base acl file (and writes).
+        self.faucet_acl_format = self.config.acl_config_format
+        self.writer = ConfigWriter(self.logger, self.config.fsync)
+        # used by the confirmer thread (only).
+        self.prom_scraper = auth_app_utils.PrometheusScraper(self.config.prom_url)
+        self.journal = None
+        if self.config.journal:
+            self.journal = AuthJournal(self.config.journal, self.logger,
+                                       fsync=self.config.fsync == 'always')
+        self.journal_compact = self.config.journal_compact
+        self.base_backups = Backups(self.base_filename, self.logger,
+                                    self.config.backup, self.config.backup_keep,
+                                    self.config.backup_max_age)
+        self.faucet_acl_backups = Backups(self.faucet_acl_filename, self.logger,
+                                          self.config.backup, self.config.backup_keep,
+                                          self.config.backup_max_age)
+        if os.path.exists(self.faucet_acl_filename):
+            with open(self.faucet_acl_filename, 'rb') as f:
+                self.faucet_acl_digest = hashlib.sha1(f.read()).hexdigest()
+        self.base_history = None
+        self.faucet_acl_history = None
+        if self.config.history_dir:
+            self.base_history = HistoryStore(
+                os.path.join(self.config.history_dir, os.path.basename(self.base_filename)),
+                keep=self.config.history_keep, max_age=self.config.history_max_age)
+            self.faucet_acl_history = HistoryStore(
+                os.path.join(self.config.history_dir, os.path.basename(self.faucet_acl_filename)),
+                keep=self.config.history_keep, max_age=self.config.history_max_age)
+        self.batch_window = self.config.reload_batch_window
+        self.batch_size = self.config.reload_batch_size
+        self.pending = []
+        self.compiled_acls = {}
+        self.dirty_acls = set()
+        self.acl_fragments = {}
+        self.unconfirmed = {}
+        self.failed_changes = []
+        self.lock = threading.Lock()
+        self.reload_waiter = ReloadWaiter(dps=len(self.config.dps))
+        self.confirmer = ReloadConfirmer(self, self.reload_waiter, self.config.logger_location,
+                                         timeout=self.config.reload_timeout,
+                                         retries=self.config.reload_retries)
+        self.reload_base()
+
+    def reload_base(self):
+        """(Re)loads the base config from file into memory.
+        Should only be needed at startup or if the base file has been changed by something else.
+        """
+        self.base = load_config(self.base_filename, self.base_format)
+        self.compiled_acls = {}
+        self.dirty_acls = set()
+        self.acl_fragments = {}
+        self.blocks = {}
+        self.anchor_prefixes = {}
+        self.removed_entries = set()
+        if self.shared_blocks:
+            for rules in (self.base.get('aauth') or {}).values():
+                self.share_blocks(rules)
+            for port_acl_list in self.base['acls'].values():
+                for item in port_acl_list:
+                    if isinstance(item, dict) and 'rule' not in item:
+                        for rules in item.values():
+                            self.share_blocks(rules)
+        self.build_indexes()
+        self.logger.info('loaded base config %s', self.base_filename)
+        if self.journal:
+            records = self.journal.records()
+            for record in records:
+                self.replay(record)
+            self.purge_removed()
+            self.logger.info('replayed %d journal records', len(records))
+
+    def replay(self, record):
+        """Applies a journal record to the in memory base.
+        Args:
+            record (dict): see AuthJournal.
+        """
+        try:
+            if record['op'] == 'add':
+                self._add_to_base(record['rules'], record['user'], record['mac'],
+                                  record.get('session'))
+            elif record['op'] == 'remove':
+                for key in record['keys']:
+                    if key in self.base['aauth']:
+                        self.remove_aauth_key(key)
+                self.base.get('sessions', {}).pop(record.get('mac'), None)
+        except (KeyError, ValueError) as e:
+            # e.g. port acl has been removed from the base.
+            self.logger.warning('unable to replay journal record %s', record)
+            self.logger.exception(e)
+
+    def share_blocks(self, rules):
+        """Replaces the nested values (blocks, e.g. 'actions') of rules with
+        a single shared copy of each distinct value, so the faucet acl file can alias them.
+        The blocks must not be modified.
+        Args:
+            rules (list): of {'rule': rule}.
+        """
+        for r in rules:
+            rule = r['rule']
+            for k, v in rule.items():
+                if isinstance(v, (dict, list)):
+                    rule[k] = self.blocks.setdefault(json.dumps(v, sort_keys=True), v)
+
+    def add_to_base_acls(self, rules, user, mac, session=None):
+        '''Adds rules to the in memory base acls.
+        The base file is written (or the journal appended to) on the next commit().
         Args:
-            filename (str);
             rules (dict): {port_s1_1 : list of rules}
             user (str): username
+            session (dict): where & how the mac authenticated. See get_sessions().
         '''
-        with open(filename) as f:
-            base = yaml.safe_load(f)
+        base = self._add_to_base(rules, user, mac, session)
+        if self.journal:
+            self.journal.append({'op': 'add', 'user': user, 'mac': mac, 'rules': rules,
+                                 'session': session})
+        self.base_changed = True
+        return base
+
+    def _add_to_base(self, rules, user, mac, session=None):
+        """See add_to_base_acls()."""
+        base = self.base
+        if session:
+            base.setdefault('sessions', {})[mac] = session
         # somehow add the rules to the base where ideally the items in the acl are the pointers.
         # but guess it might not matter, just hurts readability.
 
         # this is NOT a spelling mistake. this ensures that the auth rules are defined before
         # the use in the port acl.
         # and that the port acl will have the pointer. At the end of the day it doesn't matter.
-        if 'aauth' not in base:
+        if not base.get('aauth'):
             base['aauth'] = {}
 
-        self.logger.debug('base %s', base)
-
         for aclname, acllist in list(rules.items()):
             self.logger.debug("aclname: %s user: %s mac:%s", aclname, user, mac)
-            base['aauth'][aclname + user + mac] = acllist
+            if self.shared_blocks:
+                self.share_blocks(acllist)
+            key = aclname + user + mac
+            if key in base['aauth']:
+                # replace, rather than have the rules in the port acl twice.
+                self.remove_aauth_key(key)
+            base['aauth'][key] = acllist
             base_acl = base['acls'][aclname]
-            i = base_acl.index('authed-rules')
-            # insert rules above the authed-rules 'flag'. Add 1 for below it.
-            # this may not be included as the reference. but instead inserting each.
-            base_acl[i:i] = [{aclname + user + mac: acllist}]
+            if (aclname, key) in self.removed_entries:
+                # removed since the last commit, so put the rules back in the same place.
+                # e.g. a deauth & auth with the same rules leaves the faucet acl unchanged.
+                self.removed_entries.discard((aclname, key))
+                base_acl[self._find_entry(base_acl, key)] = {key: acllist}
+            else:
+                i = base_acl.index('authed-rules')
+                # insert rules above the authed-rules 'flag'. Add 1 for below it.
+                # this may not be included as the reference. but instead inserting each.
+                base_acl[i:i] = [{key: acllist}]
+            self.dirty_acls.add(aclname)
+            self._index_rules(key, acllist)
+            self.port_acl_index.setdefault(key, set()).add(aclname)
+        return base
 
+    def write_base(self):
+        """Writes the in memory base to the base file, if it has changed.
+        If the journal is used, the base is only written when the journal is compacted.
+        """
+        if not self.base_changed:
+            return
+        if self.journal:
+            if self.writer.durability == 'batch':
+                self.journal.sync()
+            if self.journal.count < self.journal_compact:
+                self.base_changed = False
+                return
+            self.logger.info('compacting %d journal records into base', self.journal.count)
         # 'rotate' filename - filename.bak, filename.bak.1 this is primiarily for logging,
         # to see how users affect the config.
-
-        # write back to filename
-        write_yaml(base, filename + '.tmp')
-        self.backup_file(filename)
-        self.logger.debug('backed up base')
-        self.swap_temp_file(filename)
-        self.logger.debug('swapped tmp for base')
-        return base
+        if self.base_format == 'json':
+            text = json.dumps(self.base, separators=(',', ':'))
+        else:
+            text = yaml_utils.dump(self.base)
+        self.writer.write(self.base_filename, text, self.base_backups)
+        self.logger.debug('written base')
+        self.append_history(self.base_history, text)
+        if self.journal:
+            # the base must be in place before its records are removed.
+            self.writer.flush()
+            self.journal.truncate()
+        self.base_changed = False
 
     def authenticate(self, username, mac, switch, port, acl_list):
         """Authenticates a username and MAC address on a switch and port.
@@ -189,7 +468,8 @@ class RuleManager(object):
             port (str): the 'access port' as configured in 'auth.yaml'
             acl_list (list of str): names of acls (in order of highest priority to lowest) to be applied.
         Returns:
-            True if rules are found and faucet reloads or already authenticated. False otherwise.
+            True if rules are found and the change has been queued. False otherwise.
+            See reload_stats() for if faucet has reloaded the changes.
         """
         self.logger.debug('rule-man authenticate')
 
@@ -201,26 +481,215 @@ class RuleManager(object):
                              username, mac)
             return False
         # update base
-        base = self.add_to_base_acls(self.base_filename, rules, username, mac)
-        # update faucet
-        final = create_faucet_acls(base, self.logger)
-        write_yaml(final, self.faucet_acl_filename + '.tmp', True)
-        self.backup_file(self.faucet_acl_filename)
-        self.swap_temp_file(self.faucet_acl_filename)
-        # sighup.
-        start_count = self.get_faucet_reload_count()
-        self.send_signal(signal.SIGHUP)
-
-        self.logger.info('auth signal sent.')
-        for i in range(400):
-            end_count = self.get_faucet_reload_count()
-            if end_count > start_count:
-                self.logger.info('auth - faucet has reloaded.')
-                return True
-            time.sleep(0.05)
-            self.logger.info('auth - waiting for faucet to process sighup config reload. %d', i)
-        self.logger.error('auth - faucet did not process sighup within 20 seconds. 0.05 * 400')
-        return False
+        session = {'username': username, 'dp_name': switch, 'port': port, 'acl_list': acl_list}
+        self.add_to_base_acls(rules, username, mac, session)
+        return self.queue_change('auth', username, mac)
+
+    def queue_change(self, action, username, mac):
+        """Adds a change that has been made to the base to the current batch.
+        The batch is committed by the worker (see commit_due()), after it has finished the
+        current work item, so a deauth & auth of the same rules by one item is a single commit.
+        Args:
+            action (str): 'auth' or 'deauth'
+            username (str)
+            mac (str): MAC address
+        Returns:
+            True
+        """
+        if not self.pending:
+            self.batch_start = time.time()
+        self.pending.append((action, username, mac))
+        self.logger.info('%s for user: %s mac: %s queued. %d changes pending',
+                         action, username, mac, len(self.pending))
+        return True
+
+    def commit_due(self):
+        """Returns:
+            True if there are pending changes and the batch window has passed or
+            the batch is full.
+        """
+        self.requeue_failed()
+        if not self.pending:
+            return False
+        if time.time() < self.commit_retry_time:
+            return False
+        if self.batch_size and len(self.pending) >= self.batch_size:
+            return True
+        return time.time() - self.batch_start >= self.batch_window
+
+    def time_until_commit(self):
+        """Returns:
+            seconds until the current batch is due. None if there is no pending changes.
+        """
+        if not self.pending:
+            return None
+        now = time.time()
+        return max(0, self.batch_start + self.batch_window - now, self.commit_retry_time - now)
+
+    def commit(self):
+        """Writes the base and faucet acl files for all pending changes,
+        and submits the new generation to the confirmer which signals faucet.
+        Does not wait for faucet to reload.
+        If the files cannot be written the changes stay pending, and are committed again
+        after commit_retry_interval.
+        Returns:
+            True
+        Raises:
+            OSError: if the files cannot be written.
+        """
+        if not self.pending:
+            return True
+        batch = self.pending
+        self.logger.info('committing %d changes. rule cache: %s', len(batch),
+                         self.rule_gen.cache_stats())
+        try:
+            self.purge_removed()
+            self.write_base()
+            # update faucet
+            text = self.dump_faucet_acls()
+            digest = hashlib.sha1(text.encode()).hexdigest()
+            if digest != self.faucet_acl_digest:
+                self.writer.write(self.faucet_acl_filename, text, self.faucet_acl_backups)
+            self.writer.flush()
+        except Exception:
+            # e.g. disk full. The changes stay pending, so they are committed again.
+            self.commit_retry_time = time.time() + self.commit_retry_interval
+            raise
+        self.pending = []
+
+        self.generation += 1
+        generation = Generation(self.generation, batch)
+        self.batches += 1
+        self.batched_changes += len(batch)
+        self.last_batch_size = len(batch)
+
+        if digest == self.faucet_acl_digest:
+            # e.g. deauth & auth with the same rules.
+            self.suppressed_reloads += 1
+            self.logger.info('faucet acls unchanged by %s, not reloading. %d reloads suppressed',
+                             generation, self.suppressed_reloads)
+            generation.confirmed = True
+            self.reload_resolved(generation)
+            return True
+
+        self.faucet_acl_digest = digest
+        self.append_history(self.faucet_acl_history, text)
+
+        with self.lock:
+            for _, _, mac in batch:
+                self.unconfirmed[mac] = generation.number
+        self.confirmer.submit(generation)
+        self.logger.info('submitted %s. avg batch size: %.1f',
+                         generation, self.batched_changes / self.batches)
+        return True
+
+    def append_history(self, history, text):
+        """Adds a version to a HistoryStore (if there is one).
+        The history is only a record, so failing to write it does not fail the commit.
+        """
+        if not history:
+            return
+        try:
+            history.append(text)
+        except (OSError, ValueError) as e:
+            self.logger.error('cannot write history %s: %s', history.path, e)
+
+    def compile_faucet_acls(self):
+        """Creates the faucet acls from the in memory base.
+        Only port acls that have changed since the last call are recompiled.
+        Returns: yaml object {'acls': ...}
+        """
+        base_acls = self.base['acls']
+        for acl_name in list(self.compiled_acls):
+            if acl_name not in base_acls:
+                del self.compiled_acls[acl_name]
+                self.acl_fragments.pop(acl_name, None)
+        for acl_name, acl in base_acls.items():
+            if acl_name in self.dirty_acls or acl_name not in self.compiled_acls:
+                self.logger.debug('compiling acl %s', acl_name)
+                self.compiled_acls[acl_name] = compile_acl(acl, self.logger)
+                # serialised on next write.
+                self.acl_fragments.pop(acl_name, None)
+        self.dirty_acls.clear()
+        return {'acls': dict(self.compiled_acls)}
+
+    def dump_faucet_acls(self):
+        """Creates the text of the faucet acl file.
+        Only the port acls that have changed are serialised again,
+        the file is made by joining the cached text of each acl.
+        Returns:
+            str
+        """
+        self.compile_faucet_acls()
+        for acl_name, acl in self.compiled_acls.items():
+            if acl_name not in self.acl_fragments:
+                anchor_prefix = None
+                if self.shared_blocks:
+                    anchor_prefix = self.anchor_prefixes.setdefault(
+                        acl_name, 'a%d_' % len(self.anchor_prefixes))
+                self.acl_fragments[acl_name] = dump_acl_fragment(acl_name, acl,
+                                                                 self.faucet_acl_format,
+                                                                 anchor_prefix)
+        return assemble_acls(self.acl_fragments, self.faucet_acl_format)
+
+    def reload_resolved(self, generation):
+        """Called (by the confirmer) once faucet has reloaded generation,
+        or it has failed to. The changes of a failed generation are committed again
+        (see requeue_failed()), so faucet is signalled again with the current base.
+        Args:
+            generation (Generation)
+        """
+        with self.lock:
+            if generation.failed:
+                self.failed_reloads += 1
+                self.consecutive_failed_reloads += 1
+                self.failed_changes.extend(generation.changes)
+                # back off, in case faucet keeps rejecting the config.
+                delay = min(self.config.reload_backoff_max,
+                            self.config.reload_timeout * 2 ** (self.consecutive_failed_reloads - 1))
+                self.retry_time = time.time() + delay
+            else:
+                self.consecutive_failed_reloads = 0
+                self.last_reload_latency = time.time() - generation.created
+            for action, username, mac in generation.changes:
+                if generation.confirmed and self.unconfirmed.get(mac) == generation.number:
+                    del self.unconfirmed[mac]
+                if generation.failed:
+                    self.logger.error('%s - user: %s mac: %s faucet did not reload, '
+                                      'retrying in %ds', action, username, mac, delay)
+                else:
+                    self.logger.info('%s - user: %s mac: %s faucet reloaded: %s',
+                                     action, username, mac, generation.confirmed)
+        self.logger.info('%s resolved. reloaded: %s, latency %.3fs',
+                         generation, generation.confirmed, time.time() - generation.created)
+
+    def requeue_failed(self):
+        """Queues the changes of generations faucet failed to reload again, once retry_time
+        has passed. They are still in the base, so the next commit writes them and signals faucet.
+        """
+        with self.lock:
+            if time.time() < self.retry_time:
+                return
+            failed = self.failed_changes
+            self.failed_changes = []
+        if not failed:
+            return
+        # the acls may not have changed since, but faucet has not loaded them.
+        self.faucet_acl_digest = None
+        for action, username, mac in failed:
+            self.queue_change(action, username, mac)
+
+    def reload_stats(self):
+        """Returns:
+            dict of the faucet reload metrics.
+        """
+        with self.lock:
+            return {'generation': self.generation, 'batches': self.batches,
+                    'suppressed_reloads': self.suppressed_reloads,
+                    'failed_reloads': self.failed_reloads,
+                    'consecutive_failed_reloads': self.consecutive_failed_reloads,
+                    'last_reload_latency': self.last_reload_latency,
+                    'unconfirmed_macs': len(self.unconfirmed)}
 
     def get_faucet_reload_count(self):
         """Queries faucet prometheus and finds the number of time faucet has been reloaded.
@@ -230,19 +699,18 @@ class RuleManager(object):
         self.logger.debug('getting reload count')
         for i in range(5):
             try:
-                txt = auth_app_utils.scrape_prometheus(self.config.prom_url)
+                samples = self.prom_scraper.scrape([RELOAD_COUNT_METRIC])
                 break
-            except requests.exceptions.ConnectionError:
-                self.logger.warn('connection refused while trying to query prometheus.')
+            except requests.exceptions.RequestException as e:
+                self.logger.warn('unable to query prometheus: %s', e)
                 time.sleep(1)
         else:
             self.logger.error('Failed to scrape prometheus after 5 attempts')
             return 0
 
         self.logger.debug('got reload count')
-        for l in txt.splitlines():
-            if l.startswith('faucet_config_reload_requests'):
-                return int(float(l.split()[1]))
+        for _, value in samples[RELOAD_COUNT_METRIC]:
+            return int(value)
         return 0
 
     def remove_from_base(self, username, mac):
@@ -253,60 +721,128 @@ class RuleManager(object):
             username (str)
             mac (str): MAC address
         """
-        with open(self.base_filename) as f:
-            base = yaml.safe_load(f)
         self.logger.info('removing username %s, mac %s from base', username, mac)
-        self.logger.debug(base)
-        remove = []
-
-        if 'aauth' in base:
-            for acl in list(base['aauth'].keys()):
-                self.logger.debug('aauth acl')
-                self.logger.debug(acl)
-                for  r in base['aauth'][acl]:
-                    rule = r['rule']
-                    if '_mac_' in rule and '_name_' in rule:
-                        self.logger.debug('mac and name exist')
-                        if mac == rule['_mac_'] and \
-                                (username is None or \
-                                username == rule['_name_']):
-                            self.logger.debug('removing based on name and mac')
-                            remove.append(acl)
-                            break
-                    elif '_mac_' in rule and mac == rule['_mac_']:
-                        self.logger.debug('removing based on mac')
-                        remove.append(acl)
-                        break
-                    elif '_name_' in rule and username == rule['_name_']:
-                        self.logger.debug('removing based on name')
-                        remove.append(acl)
-                        break
+        remove = self.find_aauth_keys(username, mac)
         self.logger.info('remove from auth')
         self.logger.debug(remove)
-        removed = False
-        for aclname in remove:
-            del base['aauth'][aclname]
-            removed = True
-
-            for port_acl_name, port_acl_list in list(base['acls'].items()):
-                for item in port_acl_list:
-                    if isinstance(item, dict):
-                        if aclname in item:
-                            try:
-                                base['acls'][port_acl_name].remove(item)
-                                removed = True
-                            except Exception as e:
-                                self.logger.exception(e)
+        for key in remove:
+            self.remove_aauth_key(key)
+        session = self.base.get('sessions', {}).pop(mac, None)
 
+        removed = bool(remove) or session is not None
+        if removed and self.journal:
+            self.journal.append({'op': 'remove', 'keys': sorted(remove), 'mac': mac})
         if removed:
             # only need to write it back if something has actually changed.
-            write_yaml(base, self.base_filename + '.tmp')
-            self.backup_file(self.base_filename)
-            self.swap_temp_file(self.base_filename)
+            self.base_changed = True
 
         self.logger.info('updated base')
-        self.logger.debug(base)
-        return base, removed
+        return self.base, removed
+
+    def get_sessions(self):
+        """Returns:
+            dict of the macs authenticated, including those from before a restart.
+            mac : {'username': str, 'dp_name': str, 'port': int, 'acl_list': list of str}
+        """
+        return dict(self.base.get('sessions') or {})
+
+    def find_aauth_keys(self, username, mac):
+        """Finds the 'aauth' entries with rules that match username and/or mac.
+        See remove_from_base() for the matching rules.
+        Args:
+            username (str)
+            mac (str): MAC address
+        Returns:
+            set of 'aauth' keys.
+        """
+        keys = set()
+        for key, names in self.mac_index.get(mac, {}).items():
+            if None in names or username is None or username in names:
+                keys.add(key)
+        keys.update(self.name_index.get(username, ()))
+        return keys
+
+    def remove_aauth_key(self, key):
+        """Removes an 'aauth' entry from the base and the port acls that it is in.
+        Args:
+            key (str): 'aauth' key.
+        """
+        rules = self.base['aauth'].pop(key)
+        self._unindex_rules(key, rules)
+        for port_acl_name in self.port_acl_index.pop(key, ()):
+            port_acl_list = self.base['acls'][port_acl_name]
+            i = self._find_entry(port_acl_list, key)
+            if i is not None:
+                # keep its place until the commit. See purge_removed().
+                port_acl_list[i] = {key: []}
+                self.removed_entries.add((port_acl_name, key))
+                self.dirty_acls.add(port_acl_name)
+
+    def purge_removed(self):
+        """Deletes the places kept for the removed 'aauth' entries from the port acls.
+        They have no rules, so the faucet acls are not changed.
+        """
+        for port_acl_name, key in self.removed_entries:
+            port_acl_list = self.base['acls'].get(port_acl_name)
+            if port_acl_list is None:
+                continue
+            i = self._find_entry(port_acl_list, key)
+            if i is not None:
+                del port_acl_list[i]
+        self.removed_entries.clear()
+
+    @staticmethod
+    def _find_entry(port_acl_list, key):
+        """Returns:
+            index of the 'aauth' entry key in port_acl_list. None if it is not there.
+        """
+        for i, item in enumerate(port_acl_list):
+            if isinstance(item, dict) and key in item:
+                return i
+        return None
+
+    def build_indexes(self):
+        """(Re)builds the indexes of the 'aauth' entries from the base.
+        """
+        self.mac_index = {}
+        self.name_index = {}
+        self.port_acl_index = {}
+        aauth = self.base.get('aauth') or {}
+        for key, rules in aauth.items():
+            self._index_rules(key, rules)
+        for port_acl_name, port_acl_list in self.base['acls'].items():
+            for item in port_acl_list:
+                if isinstance(item, dict):
+                    for key in item:
+                        if key in aauth:
+                            self.port_acl_index.setdefault(key, set()).add(port_acl_name)
+
+    def _index_rules(self, key, rules):
+        """Adds the '_mac_' & '_name_' of each rule in an 'aauth' entry to the indexes.
+        """
+        for r in rules:
+            rule = r['rule']
+            if '_mac_' in rule:
+                names = self.mac_index.setdefault(rule['_mac_'], {}).setdefault(key, set())
+                names.add(rule.get('_name_'))
+            elif '_name_' in rule:
+                self.name_index.setdefault(rule['_name_'], set()).add(key)
+
+    def _unindex_rules(self, key, rules):
+        """Removes an 'aauth' entry from the indexes.
+        """
+        for r in rules:
+            rule = r['rule']
+            if '_mac_' in rule:
+                keys = self.mac_index.get(rule['_mac_'], {})
+                keys.pop(key, None)
+                if not keys:
+                    self.mac_index.pop(rule['_mac_'], None)
+            elif '_name_' in rule:
+                keys = self.name_index.get(rule['_name_'], set())
+                keys.discard(key)
+                if not keys:
+                    self.name_index.pop(rule['_name_'], None)
 
     def deauthenticate(self, username, mac):
         """Deauthenticates a username or MAC address.
@@ -314,65 +850,17 @@ class RuleManager(object):
             username (str): may be None or '(null)' which is treated as None.
             mac (str): MAC address
         Returns:
-            True if a client that is authed has rules removed, or if client is not authed.
-            other wise false (faucet fails to reload)
+            True
         """
         self.logger.info('deauthenticate user: %s mac: %s', username, mac)
         # update base
-        base, changed = self.remove_from_base(username, mac)
+        _, changed = self.remove_from_base(username, mac)
         # update faucet only if config has changed
         if changed:
             self.logger.info('base has changed. removing from faucet')
-            final = create_faucet_acls(base, self.logger)
-            write_yaml(final, self.faucet_acl_filename + '.tmp', True)
-
-            self.backup_file(self.faucet_acl_filename)
-            self.swap_temp_file(self.faucet_acl_filename)
-            # sighup.
-            start_count = self.get_faucet_reload_count()
-            self.send_signal(signal.SIGHUP)
-            self.logger.info('deauth signal sent')
-            for i in range(400):
-                end_count = self.get_faucet_reload_count()
-                if end_count > start_count:
-                    self.logger.info('deauth - faucet has reloaded.')
-                    return True
-                time.sleep(0.05)
-                self.logger.info('deauth - waiting for faucet to process sighup config reload on. %d', i)
-            self.logger.error('deauth - faucet did not process sighup within 400 * 0.05 seconds.')
-            return False
+            return self.queue_change('deauth', username, mac)
         return True
 
-    @staticmethod
-    def backup_file(filename):
-        """Backup a file. appends '.bak#' to filename.
-        Args:
-            filename (str)
-        """
-        directory = os.path.dirname(filename)
-        if directory == '':
-            directory = '.'
-
-        filenames = ''.join(os.listdir(directory))
-        search_str = os.path.basename(filename) + '.bak'
-
-        matches = re.findall(search_str, filenames)
-
-        i = str(len(matches) + 1)
-
-        # backup old current
-        shutil.copy2(filename, filename + '.bak' + i)
-
-    @staticmethod
-    def swap_temp_file(filename):
-        """Renames the temporary file to become the original.
-        Args:
-            filename (str)
-        """
-        os.remove(filename)
-        # make new tmp the current.
-        os.rename(filename + '.tmp', filename)
-
     def send_signal(self, signal_type):
         ''' Send a signal to the controller to indicate a change in config file
         Args:
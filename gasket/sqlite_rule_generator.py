@@ -0,0 +1,147 @@
+"""RuleGenerator backed by a SQLite database, for when there are too many acls
+to load the whole rules file into memory.
+Only the acls users authenticate with are read, when they are first needed.
+
+The database is created from a rules yaml file (see rule_generator) with:
+    python3 -m gasket.sqlite_rule_generator <rules.yaml> <rules.db>
+Importing again replaces the rules, which gasket picks up without a restart.
+"""
+import json
+import logging
+import sqlite3
+import sys
+import threading
+
+from gasket.rule_generator import RuleGenerator, iter_rules, make_template
+from gasket import yaml_utils
+
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS rules (
+        acl TEXT NOT NULL,
+        port_acl_position INTEGER NOT NULL,
+        port_acl TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        rule TEXT)''',
+    'CREATE INDEX IF NOT EXISTS rules_acl ON rules (acl, port_acl_position, position)',
+    'CREATE INDEX IF NOT EXISTS rules_port_acl ON rules (port_acl)',
+    # acls with no rules are still acls.
+    'CREATE TABLE IF NOT EXISTS acls (acl TEXT PRIMARY KEY)',
+]
+
+SELECT_ACL = 'SELECT acl FROM acls WHERE acl = ?'
+SELECT_RULES = '''SELECT port_acl, rule FROM rules WHERE acl = ?
+                  ORDER BY port_acl_position, position'''
+
+
+class SQLiteRuleGenerator(RuleGenerator):
+    """Gets the rules from a SQLite database (see import_rules()),
+    instead of a yaml file. The templates of each acl are read when first used.
+    """
+
+    connection = None
+    # sqlite's data_version when the templates were read, it changes when
+    # another connection (e.g. an import) modifies the database.
+    data_version = None
+    lock = None
+
+    def __init__(self, rule_file, logger, cache_size=0, shared_blocks=False, cached_statements=32):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(rule_file, check_same_thread=False,
+                                          cached_statements=cached_statements)
+        super(SQLiteRuleGenerator, self).__init__(rule_file, logger, cache_size=cache_size,
+                                                  shared_blocks=shared_blocks)
+
+    def get_acl_templates(self, aclname):
+        """Args:
+            aclname (str)
+        Returns:
+            list of (port acl name, list of templates) for the acl. None if there is no acl.
+        """
+        if aclname in self.templates:
+            return self.templates[aclname]
+        with self.lock:
+            acl_templates = None
+            if self.connection.execute(SELECT_ACL, (aclname,)).fetchone():
+                acl_templates = []
+                for port_acl, rule in self.connection.execute(SELECT_RULES, (aclname,)):
+                    if not acl_templates or acl_templates[-1][0] != port_acl:
+                        acl_templates.append((port_acl, []))
+                    if rule is not None:
+                        acl_templates[-1][1].append(make_template(json.loads(rule)))
+        # remember missing acls as well.
+        self.templates[aclname] = acl_templates
+        return acl_templates
+
+    def check_reload(self):
+        """Forgets the templates read if the database has changed since they were.
+        """
+        with self.lock:
+            data_version = self.connection.execute('PRAGMA data_version').fetchone()[0]
+        if data_version != self.data_version:
+            self.logger.info('rules database %s has changed, reloading', self.yaml_file)
+            self.reload(self.yaml_file)
+
+    def reload(self, rule_file):
+        """Forgets the templates read from the database.
+        Args:
+            rule_file: path to the database. Must be the same as the connection's.
+        """
+        self.yaml_file = rule_file
+        with self.lock:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            self.connection.commit()
+            self.data_version = self.connection.execute('PRAGMA data_version').fetchone()[0]
+        self.templates = {}
+        if self.cache:
+            self.logger.info('clearing rule cache %s', self.cache_stats())
+            self.cache.clear()
+
+
+def import_rules(conf, db_filename, logger):
+    """Replaces the rules in a database with those from a rules config.
+    Args:
+        conf (dict): parsed rules yaml file.
+        db_filename (str)
+        logger
+    Returns:
+        number of rules imported.
+    """
+    count = 0
+    connection = sqlite3.connect(db_filename)
+    try:
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.execute('DELETE FROM rules')
+            connection.execute('DELETE FROM acls')
+            for aclname, acl in (conf.get('acls') or {}).items():
+                connection.execute('INSERT INTO acls VALUES (?)', (aclname,))
+                rows = []
+                for port_acl_position, (port_acl, objs) in enumerate(acl.items()):
+                    port_rows = [(aclname, port_acl_position, port_acl, position,
+                                  json.dumps(rule, sort_keys=True))
+                                 for position, rule in enumerate(iter_rules(objs, logger))]
+                    count += len(port_rows)
+                    # a port acl with no rules is a row with a NULL rule.
+                    rows.extend(port_rows or [(aclname, port_acl_position, port_acl, 0, None)])
+                connection.executemany('INSERT INTO rules VALUES (?, ?, ?, ?, ?)', rows)
+    finally:
+        connection.close()
+    return count
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__)
+        return
+    # pylint: disable=unbalanced-tuple-unpacking
+    yaml_filename, db_filename = sys.argv[1:3]
+    logging.basicConfig(level=logging.INFO)
+    count = import_rules(yaml_utils.load_file(yaml_filename), db_filename, logging)
+    print('imported %d rules into %s' % (count, db_filename))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""Work queue for the AuthApp worker, that lets security relevant work
+(deauthentications, port changes) go ahead of authentications, and both ahead of
+mac learning, which can arrive in floods (e.g. when a switch reconnects).
+"""
+import collections
+import itertools
+import queue
+import threading
+import time
+
+from gasket import work_item
+
+
+class PriorityWorkQueue(object):
+    """Drop in replacement for queue.Queue (put(), get(), qsize(), empty())
+    with a FIFO per class of work item, highest priority (lowest number) first.
+
+    Reordering must not change the outcome, so:
+        - a deauth replaces the pending auths of the same mac,
+          rather than being done before them.
+        - an auth does not go ahead of pending learns of the same mac
+          (which port the host is authenticated on depends on them).
+        - a port change does not go ahead of pending auths (which port a host
+          will be authenticated on is not known here), and replaces the pending learns
+          on that port when the port is down.
+    A class that has been passed over max_skip times while it had work waiting
+    is served next (starvation protection).
+    """
+
+    DEAUTH = 0
+    AUTH = 1
+    LEARN = 2
+    CLASSES = (DEAUTH, AUTH, LEARN)
+    CLASS_NAMES = ('deauth', 'auth', 'learn')
+
+    max_skip = 100
+
+    # list (by class) of deque of (sequence number, enqueue time, work item).
+    queues = None
+    # list (by class) of times gotten ahead of while having work waiting.
+    skips = None
+    # mac : deque of the sequence numbers of its pending learns, oldest first.
+    learn_seqs = None
+    lock = None
+    not_empty = None
+    sequence = None
+
+    # metrics, lists by class.
+    puts = None
+    gets = None
+    # items replaced by a later item. See class docstring.
+    superseded = None
+    max_depth = None
+    # seconds the last item of the class waited in the queue.
+    last_wait = None
+
+    def __init__(self, max_skip=100):
+        """
+        Args:
+            max_skip (int): number of items that can be gotten ahead of a waiting class,
+                            before it is served. 0 for no limit.
+        """
+        self.max_skip = max_skip
+        self.queues = [collections.deque() for _ in self.CLASSES]
+        self.skips = [0 for _ in self.CLASSES]
+        self.puts = [0 for _ in self.CLASSES]
+        self.gets = [0 for _ in self.CLASSES]
+        self.superseded = [0 for _ in self.CLASSES]
+        self.max_depth = [0 for _ in self.CLASSES]
+        self.last_wait = [None for _ in self.CLASSES]
+        self.learn_seqs = {}
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.sequence = itertools.count()
+
+    def classify(self, item):
+        """Returns:
+            the class (priority) of a work item.
+        """
+        if isinstance(item, (work_item.DeauthWorkItem, work_item.PortChangeWorkItem)):
+            return self.DEAUTH
+        if isinstance(item, work_item.L2LearnWorkItem):
+            return self.LEARN
+        return self.AUTH
+
+    def put(self, item, block=True, timeout=None):
+        """Adds a work item. Never blocks, the arguments are for queue.Queue compatibility.
+        """
+        cls = self.classify(item)
+        with self.lock:
+            if isinstance(item, work_item.DeauthWorkItem):
+                self._supersede(self.AUTH, lambda other: other.mac == item.mac)
+            elif isinstance(item, work_item.PortChangeWorkItem) and not item.status:
+                self._supersede(self.LEARN, lambda other: other.dp_name == item.dp_name
+                                and other.port == item.port_no)
+            seq = next(self.sequence)
+            self.queues[cls].append((seq, time.time(), item))
+            if cls == self.LEARN:
+                self.learn_seqs.setdefault(item.mac, collections.deque()).append(seq)
+            self.puts[cls] += 1
+            self.max_depth[cls] = max(self.max_depth[cls], len(self.queues[cls]))
+            self.not_empty.notify()
+
+    def _supersede(self, cls, match):
+        """Removes the items of a class that match.
+        """
+        keep = collections.deque()
+        for entry in self.queues[cls]:
+            if not match(entry[2]):
+                keep.append(entry)
+            elif cls == self.LEARN:
+                self._forget_learn(entry)
+        self.superseded[cls] += len(self.queues[cls]) - len(keep)
+        self.queues[cls] = keep
+
+    def _forget_learn(self, entry):
+        """Removes a learn that is no longer pending from learn_seqs.
+        """
+        seq, _, item = entry
+        seqs = self.learn_seqs[item.mac]
+        seqs.remove(seq)
+        if not seqs:
+            del self.learn_seqs[item.mac]
+
+    def get(self, block=True, timeout=None):
+        """Removes and returns the next work item.
+        Args:
+            block (bool): wait for an item if there are none.
+            timeout (float): seconds to wait. None waits forever.
+        Raises:
+            queue.Empty: if no item is available (within timeout).
+        """
+        with self.not_empty:
+            if block:
+                if not self.not_empty.wait_for(self._qsize, timeout):
+                    raise queue.Empty
+            elif not self._qsize():
+                raise queue.Empty
+            cls = self._next_class()
+            entry = self.queues[cls].popleft()
+            _, put_time, item = entry
+            if cls == self.LEARN:
+                self._forget_learn(entry)
+            self.gets[cls] += 1
+            self.last_wait[cls] = time.time() - put_time
+            for other in self.CLASSES:
+                if other != cls and self.queues[other]:
+                    self.skips[other] += 1
+            self.skips[cls] = 0
+            return item
+
+    def _next_class(self):
+        """Returns:
+            the class to get the next item from. There must be an item.
+        """
+        if self.max_skip:
+            for cls in self.CLASSES:
+                if self.queues[cls] and self.skips[cls] >= self.max_skip:
+                    return self._auth_or_learn() if cls == self.AUTH else cls
+        deauths, auths = self.queues[self.DEAUTH], self.queues[self.AUTH]
+        if deauths:
+            if auths and auths[0][0] < deauths[0][0] \
+                    and isinstance(deauths[0][2], work_item.PortChangeWorkItem):
+                # port changes do not go ahead of auths.
+                return self._auth_or_learn()
+            return self.DEAUTH
+        if auths:
+            return self._auth_or_learn()
+        return self.LEARN
+
+    def _auth_or_learn(self):
+        """Returns:
+            AUTH, or LEARN if the next auth's mac has a learn pending from before it.
+            The learns are in order, so the ones before that learn are older too.
+        """
+        seq, _, item = self.queues[self.AUTH][0]
+        seqs = self.learn_seqs.get(item.mac)
+        if seqs and seqs[0] < seq:
+            return self.LEARN
+        return self.AUTH
+
+    def _qsize(self):
+        return sum(len(q) for q in self.queues)
+
+    def qsize(self):
+        """Returns:
+            number of items waiting.
+        """
+        with self.lock:
+            return self._qsize()
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def stats(self):
+        """Returns:
+            dict of class name : dict of metrics.
+        """
+        with self.lock:
+            return {name: {'depth': len(self.queues[cls]), 'max_depth': self.max_depth[cls],
+                           'puts': self.puts[cls], 'gets': self.gets[cls],
+                           'superseded': self.superseded[cls],
+                           'last_wait': self.last_wait[cls]}
+                    for cls, name in zip(self.CLASSES, self.CLASS_NAMES)}
@@ -0,0 +1,91 @@
+"""YAML loading and dumping used by gasket.
+Uses PyYAML's libyaml (C) loader and dumper if PyYAML has been built with them,
+otherwise falls back to the pure python ones.
+"""
+# pytype: disable=pyi-error
+import io
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+    from yaml import CSafeDumper as SafeDumper
+    LIBYAML = True
+except ImportError:
+    from yaml import SafeLoader
+    from yaml import SafeDumper
+    LIBYAML = False
+
+
+class NoAliasDumper(SafeDumper):
+    """SafeDumper that writes objects out in full instead of using aliases.
+    """
+
+    def ignore_aliases(self, data):
+        return True
+
+
+class AnchorPrefixDumper(yaml.SafeDumper):
+    """Pure python SafeDumper that names anchors anchor_prefix + number,
+    so yaml dumped separately can be joined into one document without the anchors clashing.
+    (libyaml's dumper does not allow the anchors to be named).
+    """
+
+    def __init__(self, stream, anchor_prefix='id', **kwargs):
+        super(AnchorPrefixDumper, self).__init__(stream, **kwargs)
+        self.anchor_prefix = anchor_prefix
+
+    def generate_anchor(self, node):
+        self.last_anchor_id += 1
+        return '%s%d' % (self.anchor_prefix, self.last_anchor_id)
+
+
+def load(stream):
+    """Loads yaml.
+    Args:
+        stream (str or file)
+    Returns:
+        loaded object.
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def load_file(filename):
+    """Loads a yaml file.
+    Args:
+        filename (str)
+    Returns:
+        loaded object.
+    """
+    with open(filename) as f:
+        return load(f)
+
+
+def dump(data, stream=None, ignore_aliases=False, anchor_prefix=None):
+    """Dumps data as block style yaml.
+    Args:
+        data: object to dump.
+        stream (file): if None the yaml is returned as a str.
+        ignore_aliases (bool): True if yaml aliases should be removed
+                                and object written out in full.
+                                False if aliases can be used.
+        anchor_prefix (str): prefix of the anchors names, instead of 'id'.
+                             Uses the pure python dumper.
+    Returns:
+        str if stream is None.
+    """
+    if anchor_prefix is not None and not ignore_aliases:
+        out = stream or io.StringIO()
+        dumper = AnchorPrefixDumper(out, anchor_prefix=anchor_prefix,
+                                    default_flow_style=False)
+        try:
+            dumper.open()
+            dumper.represent(data)
+            dumper.close()
+        finally:
+            dumper.dispose()
+        if stream is None:
+            return out.getvalue()
+        return None
+    dumper = NoAliasDumper if ignore_aliases else SafeDumper
+    return yaml.dump(data, stream, Dumper=dumper, default_flow_style=False)
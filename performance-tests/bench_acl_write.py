@@ -0,0 +1,82 @@
+"""Benchmark of writing the faucet acl file after a single user has authenticated.
+Compares serialising the whole acl tree (the old path) against re-serialising
+only the changed port acl and joining the cached fragments (RuleManager.dump_faucet_acls).
+
+Usage: python3 bench_acl_write.py [ports] [users]
+(gasket must be importable, e.g. PYTHONPATH=..)
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from gasket import rule_manager
+
+
+def make_base(ports, users):
+    """Creates a base config with users spread evenly over ports."""
+    acls = {}
+    for p in range(ports):
+        acls['port_faucet-1_%d' % p] = [
+            {'rule': {'dl_type': 0x888e, 'actions': {'allow': 1}}},
+            'authed-rules',
+            {'rule': {'actions': {'allow': 0}}}]
+    base = {'acls': acls, 'aauth': {}}
+    for u in range(users):
+        mac = '00:00:00:%02x:%02x:%02x' % (u >> 16 & 0xff, u >> 8 & 0xff, u & 0xff)
+        add_user(base, 'port_faucet-1_%d' % (u % ports), 'user%d' % u, mac)
+    return base
+
+
+def add_user(base, port_acl, user, mac):
+    """Adds rules for user to base, the same way RuleManager.add_to_base_acls does."""
+    rules = [{'rule': {'_name_': user, '_mac_': mac, 'dl_src': mac, 'dl_type': t,
+                       'actions': {'allow': 1}}} for t in (0x800, 0x806)]
+    key = port_acl + user + mac
+    base['aauth'][key] = rules
+    acl = base['acls'][port_acl]
+    i = acl.index('authed-rules')
+    acl[i:i] = [{key: rules}]
+
+
+def bench(ports=200, users=3000, trials=5):
+    log = logging.getLogger('bench')
+    base = make_base(ports, users)
+    out = os.path.join(tempfile.mkdtemp(), 'faucet-acls.yaml')
+
+    full = []
+    for t in range(trials):
+        add_user(base, 'port_faucet-1_0', 'new%d' % t, '11:11:11:11:11:%02x' % t)
+        start = time.perf_counter()
+        rule_manager.write_yaml(rule_manager.create_faucet_acls(base, log), out, True)
+        full.append(time.perf_counter() - start)
+    with open(out) as f:
+        full_text = f.read()
+
+    # warm the caches, as RuleManager's would be after the first write.
+    compiled = rule_manager.create_faucet_acls(base, log)['acls']
+    fragments = {name: rule_manager.dump_acl_fragment(name, acl) for name, acl in compiled.items()}
+    with open(out, 'w') as f:
+        f.write(rule_manager.assemble_acls(fragments))
+    with open(out) as f:
+        assert f.read() == full_text, 'fragment output differs from full dump'
+
+    incremental = []
+    for t in range(trials):
+        add_user(base, 'port_faucet-1_0', 'inc%d' % t, '22:22:22:22:22:%02x' % t)
+        start = time.perf_counter()
+        name = 'port_faucet-1_0'
+        acl = rule_manager.compile_acl(base['acls'][name], log)
+        fragments[name] = rule_manager.dump_acl_fragment(name, acl)
+        with open(out, 'w') as f:
+            f.write(rule_manager.assemble_acls(fragments))
+        incremental.append(time.perf_counter() - start)
+
+    print('%d ports, %d users' % (ports, users))
+    print('full dump:      %8.2f ms' % (1000 * min(full)))
+    print('fragment write: %8.2f ms' % (1000 * min(incremental)))
+
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:3]])
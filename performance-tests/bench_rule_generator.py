@@ -0,0 +1,57 @@
+"""Benchmark of RuleGenerator.get_rules with rules files of increasing size.
+Compares the per call cost of re-parsing the rules file (what get_rules used to do)
+against filling the templates that are parsed once (with the expansion cache).
+
+Usage: python3 bench_rule_generator.py [max acls]
+(gasket must be importable, e.g. PYTHONPATH=..)
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from gasket import rule_generator
+from gasket import yaml_utils
+
+
+def make_rules(acls):
+    """Creates a rules config with acls, each with a few rules on the auth port."""
+    conf = {'acls': {}}
+    for a in range(acls):
+        conf['acls']['acl-%d' % a] = {'_authport_': [
+            {'rule': {'_name_': '_user-name_', '_mac_': '_user-mac_', 'dl_src': '_user-mac_',
+                      'dl_type': t, 'actions': {'allow': a % 2}}} for t in (0x800, 0x806, 0x86dd)]}
+    return conf
+
+
+def best_of(func, trials, calls):
+    times = []
+    for _ in range(trials):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        times.append((time.perf_counter() - start) / calls)
+    return min(times)
+
+
+def bench(max_acls=10000, trials=3):
+    log = logging.getLogger('bench')
+    directory = tempfile.mkdtemp()
+    acls = 10
+    while acls <= max_acls:
+        filename = os.path.join(directory, 'rules-%d.yaml' % acls)
+        with open(filename, 'w') as f:
+            yaml_utils.dump(make_rules(acls), f)
+        gen = rule_generator.RuleGenerator(filename, log, cache_size=1024)
+        acl_list = ['acl-0', 'acl-%d' % (acls - 1)]
+        reparse = best_of(lambda: yaml_utils.load_file(filename), trials, 1)
+        templates = best_of(lambda: gen.get_rules('user', 'port_faucet-1_2',
+                                                   '00:00:00:00:00:01', acl_list), trials, 1000)
+        print('%6d acls  re-parse: %10.3f ms  templates: %8.3f ms'
+              % (acls, 1000 * reparse, 1000 * templates))
+        acls *= 10
+
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,224 @@
+"""Benchmark of the threaded and asyncio (async_runtime) runtimes with many hostapds.
+Each hostapd is a pair of socketpairs standing in for the hostapd control sockets,
+with the hostapd end (sending the messages and answering the requests) in a child
+process, so only the runtime is measured.
+Measures the CPU used while idle (waking every unsolicited_timeout to ping),
+and the CPU used and latency (message sent to work queued) for messages sent at
+a steady rate, and as a burst (as fast as possible).
+
+Usage: python3 bench_runtime.py [hostapds] [messages]
+(gasket must be importable, e.g. PYTHONPATH=..)
+"""
+import multiprocessing
+import os
+import selectors
+import socket
+import statistics
+import sys
+import threading
+import time
+import types
+
+from gasket import async_runtime
+from gasket import hostapd_ctrl
+from gasket import hostapd_socket_thread
+
+
+IDLE_SECONDS = 5
+UNSOLICITED_TIMEOUT = 0.5
+# messages per second for the steady phase.
+RATE = 1000
+
+
+class PairCtrl(hostapd_ctrl.HostapdCtrl):
+    """HostapdCtrl on one end of a socketpair."""
+
+    def __init__(self, soc, timeout, logger):
+        self.soc = soc
+        self.timeout = timeout
+        self.logger = logger
+        self.set_timeout(timeout)
+
+    def close(self):
+        self.soc.close()
+
+
+def mac_of(m):
+    return '00:00:00:%02x:%02x:%02x' % (m >> 16 & 0xff, m >> 8 & 0xff, m & 0xff)
+
+
+def hostapd_process(senders, responders, conn):
+    """The hostapd end of the sockets, run in the child process.
+    Answers requests (PING with PONG, others with a STA), and sends messages when
+    asked to on conn, replying with the times they were sent.
+    """
+    sta = ('dot1xAuthSessionUserName=user\n'
+           'AccessAccept:Vendor-Specific:12345:1=student\n').encode()
+
+    def respond():
+        selector = selectors.DefaultSelector()
+        for soc in responders:
+            selector.register(soc, selectors.EVENT_READ)
+        while True:
+            for key, _ in selector.select():
+                try:
+                    cmd = key.fileobj.recv(4096)
+                    key.fileobj.send(b'PONG\n' if cmd == b'PING' else sta)
+                except OSError:
+                    selector.unregister(key.fileobj)
+
+    threading.Thread(target=respond, daemon=True).start()
+    while True:
+        messages, rate = conn.recv()
+        sent = []
+        start = time.time()
+        for m in range(messages):
+            if rate:
+                delay = start + m / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            if m % 2:
+                message = '<3>CTRL-EVENT-EAP-SUCCESS %s' % mac_of(m)
+            else:
+                message = '<3>AP-STA-DISCONNECTED %s' % mac_of(m)
+            sent.append(time.time())
+            senders[m % len(senders)].send(message.encode())
+        conn.send(sent)
+
+
+class BenchHostapd(hostapd_socket_thread.HostapdSocket):
+    """HostapdSocket with the sockets replaced by (our ends of) socketpairs."""
+
+    # (unsolicited, request) sockets.
+    pair = None
+
+    def init_sockets(self):
+        unsolicited, request = self.pair
+        self.unsolicited_sock = PairCtrl(unsolicited, self.conf.unsolicited_timeout,
+                                         self.logger)
+        self.request_sock = PairCtrl(request, 1, self.logger)
+
+
+class BenchHostapdThread(BenchHostapd, hostapd_socket_thread.HostapdSocketThread):
+    pass
+
+
+class TimingQueue(object):
+    """Work queue that records when each message was queued."""
+
+    def __init__(self):
+        self.queued = {}
+        self.expected = 0
+        self.all_queued = threading.Event()
+        self.lock = threading.Lock()
+
+    def reset(self, expected):
+        with self.lock:
+            self.queued = {}
+            self.expected = expected
+            self.all_queued.clear()
+
+    def put(self, item, block=True, timeout=None):
+        with self.lock:
+            self.queued[item.mac] = time.time()
+            if len(self.queued) >= self.expected:
+                self.all_queued.set()
+
+
+def make_conf(name):
+    return types.SimpleNamespace(name=name, logger_level='ERROR', udp=False,
+                                 unsolicited_timeout=UNSOLICITED_TIMEOUT)
+
+
+def send(conn, work_queue, messages, rate=None):
+    """Has the hostapds send messages round robin, and waits for them to be queued.
+    Args:
+        rate (int): messages per second, None for as fast as possible.
+    Returns:
+        list of the times the messages were sent.
+    """
+    work_queue.reset(messages)
+    conn.send((messages, rate))
+    sent = conn.recv()
+    # messages are lost if a request to hostapd times out.
+    work_queue.all_queued.wait(10)
+    return sent
+
+
+def measure(phase, conn, work_queue, messages, rate=None):
+    cpu, wall = time.process_time(), time.time()
+    sent = send(conn, work_queue, messages, rate)
+    cpu, wall = time.process_time() - cpu, time.time() - wall
+    with work_queue.lock:
+        latencies = sorted(work_queue.queued[mac_of(m)] - sent[m] for m in range(messages)
+                           if mac_of(m) in work_queue.queued)
+    print('    %-6s cpu: %6.3f s  %6.0f msgs/s  latency mean: %7.2f ms  p99: %7.2f ms  lost: %d'
+          % (phase, cpu, len(latencies) / wall, 1000 * statistics.mean(latencies),
+             1000 * latencies[int(len(latencies) * 0.99)], messages - len(latencies)))
+
+
+def run(name, hostapd_class, start, stop, num_hostapds, messages):
+    work_queue = TimingQueue()
+    hostapds = [hostapd_class(make_conf('bench-%d' % h), work_queue, os.devnull)
+                for h in range(num_hostapds)]
+    senders, responders = [], []
+    for hostapd in hostapds:
+        sender, unsolicited = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        responder, request = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        senders.append(sender)
+        responders.append(responder)
+        hostapd.pair = (unsolicited, request)
+    conn, child_conn = multiprocessing.Pipe()
+    # forked before any of the runtime's threads are started.
+    child = multiprocessing.get_context('fork').Process(
+        target=hostapd_process, args=(senders, responders, child_conn), daemon=True)
+    child.start()
+    for soc in senders + responders:
+        soc.close()
+
+    runtime = start(hostapds)
+    while not all(h.request_sock for h in hostapds):
+        time.sleep(0.01)
+    cpu, wall = time.process_time(), time.time()
+    time.sleep(IDLE_SECONDS)
+    cpu, wall = time.process_time() - cpu, time.time() - wall
+    print('%-8s threads: %4d  idle cpu: %5.1f%%'
+          % (name, threading.active_count(), 100 * cpu / wall))
+    measure('steady', conn, work_queue, min(messages, RATE * 5), RATE)
+    measure('burst', conn, work_queue, messages)
+    stop(runtime, hostapds)
+    child.terminate()
+    child.join()
+
+
+def start_threads(hostapds):
+    for hostapd in hostapds:
+        hostapd.start()
+    return hostapds
+
+
+def stop_threads(_, hostapds):
+    for hostapd in hostapds:
+        hostapd.kill()
+    for hostapd in hostapds:
+        hostapd.join()
+
+
+def start_async(hostapds):
+    runtime = async_runtime.AsyncRuntime(hostapds, None, os.devnull)
+    runtime.start()
+    return runtime
+
+
+def stop_async(runtime, _):
+    runtime.kill()
+
+
+def bench(num_hostapds=150, messages=20000):
+    print('%d hostapds, %d messages' % (num_hostapds, messages))
+    run('threads', BenchHostapdThread, start_threads, stop_threads, num_hostapds, messages)
+    run('asyncio', BenchHostapd, start_async, stop_async, num_hostapds, messages)
+
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,90 @@
+"""Benchmark of AuthApp startup with many hosts already learnt & authenticated.
+Compares learning each mac as a separate L2Learn work item through the work queue
+(AuthApp.process_work, which is what happened before, and left the hosts unauthenticated),
+against learning them in one pass (AuthApp.bulk_learn) and rebuilding the hosts from the
+rule manager's sessions (AuthApp.warm_start).
+
+Usage: python3 bench_warm_start.py [hosts]
+(gasket must be importable, e.g. PYTHONPATH=..)
+"""
+import logging
+import queue
+import sys
+import time
+
+from gasket import auth_app
+from gasket import config_parser
+from gasket import work_item
+
+
+PORTS = 500
+
+
+class SessionRuleManager(object):
+    """Stands in for the RuleManager, only has the sessions."""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def get_sessions(self):
+        return dict(self.sessions)
+
+    def authenticate(self, *args):
+        raise AssertionError('warm start must not change the rules')
+
+    deauthenticate = authenticate
+
+
+def make_app(sessions):
+    interfaces = {p: {'auth_mode': 'access', 'hostapds': ['hostapd-1']}
+                  for p in range(1, PORTS + 1)}
+    conf = {'dps': {'faucet-1': {'dp_id': 1, 'interfaces': interfaces}},
+            'hostapds': {'hostapd-1': {'unix_socket_path': '/tmp/hostapd'}}}
+    app = auth_app.AuthApp.__new__(auth_app.AuthApp)
+    app.dps, app.hostapds = config_parser.parse_config(conf)
+    app.logger = logging.getLogger('bench')
+    app.rule_man = SessionRuleManager(sessions)
+    app.macs = {}
+    app.work_queue = queue.Queue()
+    return app
+
+
+def bench(hosts=10000):
+    sessions = {}
+    mac_table = []
+    for h in range(hosts):
+        mac = '00:00:00:%02x:%02x:%02x' % (h >> 16 & 0xff, h >> 8 & 0xff, h & 0xff)
+        port = h % PORTS + 1
+        sessions[mac] = {'username': 'user%d' % h, 'dp_name': 'faucet-1', 'port': port,
+                         'acl_list': ['student']}
+        mac_table.append(work_item.L2LearnWorkItem('faucet-1', 1, port, 100, mac, None))
+
+    app = make_app({})
+    start = time.perf_counter()
+    for host_wi in mac_table:
+        app.work_queue.put(host_wi)
+    while not app.work_queue.empty():
+        app.process_work(app.work_queue.get())
+    cold = time.perf_counter() - start
+
+    app = make_app({})
+    start = time.perf_counter()
+    app.bulk_learn(mac_table)
+    bulk = time.perf_counter() - start
+
+    app = make_app(sessions)
+    start = time.perf_counter()
+    app.warm_start(mac_table)
+    warm = time.perf_counter() - start
+    authed = sum(1 for host in app.macs.values()
+                 if isinstance(host, auth_app.LearntAuthenticatedHost))
+    assert authed == hosts and app.work_queue.empty()
+
+    print('%d hosts' % hosts)
+    print('l2learn work items: %8.1f ms (hosts unauthenticated)' % (1000 * cold))
+    print('bulk learn:         %8.1f ms (hosts unauthenticated)' % (1000 * bulk))
+    print('warm start:         %8.1f ms (%d hosts authenticated)' % (1000 * warm, authed))
+
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,50 @@
+"""Benchmark of parsing and emitting a base config with the pure python
+and the libyaml (C) PyYAML backends.
+
+Usage: python3 bench_yaml.py [users]
+(gasket must be importable, e.g. PYTHONPATH=..)
+"""
+import sys
+import time
+
+import yaml
+
+from bench_acl_write import make_base
+
+
+def noalias(dumper):
+    """Returns a subclass of dumper that does not use aliases."""
+    return type('NoAlias' + dumper.__name__, (dumper,),
+                {'ignore_aliases': lambda self, data: True})
+
+
+def best_of(func, trials):
+    times = []
+    for _ in range(trials):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench(users=5000, trials=3):
+    base = make_base(200, users)
+    backends = [('python', yaml.SafeLoader, yaml.SafeDumper)]
+    if hasattr(yaml, 'CSafeLoader'):
+        backends.append(('libyaml', yaml.CSafeLoader, yaml.CSafeDumper))
+    else:
+        print('PyYAML has not been built with libyaml')
+
+    text = yaml.dump(base, Dumper=yaml.SafeDumper, default_flow_style=False)
+    print('%d users, base file %d KB' % (users, len(text) // 1024))
+    for name, loader, dumper in backends:
+        parse = best_of(lambda: yaml.load(text, Loader=loader), trials)
+        emit = best_of(lambda: yaml.dump(base, Dumper=dumper, default_flow_style=False), trials)
+        emit_noalias = best_of(lambda: yaml.dump(base, Dumper=noalias(dumper),
+                                                 default_flow_style=False), trials)
+        print('%-8s parse: %8.1f ms  emit: %8.1f ms  emit (no aliases): %8.1f ms'
+              % (name, 1000 * parse, 1000 * emit, 1000 * emit_noalias))
+
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Unit tests for gasket.auth_journal (no mininet needed).
+Run from the repository root: python3 -m unittest tests.test_auth_journal"""
+
+# pylint: disable=missing-docstring
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from gasket.auth_journal import AuthJournal
+
+
+ADD = {'op': 'add', 'user': 'user1', 'mac': '00:00:00:00:00:01',
+       'rules': {'port_faucet-1_3': [{'rule': {'actions': {'allow': 1}}}]}}
+REMOVE = {'op': 'remove', 'keys': ['user1 00:00:00:00:00:01']}
+
+
+class AuthJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'journal')
+        self.logger = logging.getLogger('test_auth_journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def open_journal(self):
+        journal = AuthJournal(self.filename, self.logger)
+        self.addCleanup(journal.journal_file.close)
+        return journal
+
+    def test_append_and_replay(self):
+        journal = self.open_journal()
+        journal.append(ADD)
+        journal.append(REMOVE)
+        self.assertEqual(self.open_journal().records(), [ADD, REMOVE])
+
+    def test_replay_after_torn_record(self):
+        # crashed part way through writing the second add.
+        with open(self.filename, 'w') as f:
+            f.write(json.dumps(ADD) + '\n')
+            f.write(json.dumps(ADD)[:20])
+        journal = self.open_journal()
+        self.assertEqual(journal.count, 1)
+        journal.append(REMOVE)
+        # the remove is not lost by being joined to the torn record.
+        self.assertEqual(self.open_journal().records(), [ADD, REMOVE])
+
+    def test_replay_after_torn_first_record(self):
+        with open(self.filename, 'w') as f:
+            f.write(json.dumps(ADD)[:20])
+        journal = self.open_journal()
+        self.assertEqual(journal.count, 0)
+        journal.append(REMOVE)
+        self.assertEqual(self.open_journal().records(), [REMOVE])
+
+    def test_truncate(self):
+        journal = self.open_journal()
+        journal.append(ADD)
+        journal.truncate()
+        journal.append(REMOVE)
+        self.assertEqual(journal.count, 1)
+        self.assertEqual(self.open_journal().records(), [REMOVE])
+
+
+if __name__ == '__main__':
+    unittest.main()
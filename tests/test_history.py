@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""Unit tests for gasket.history (no mininet needed).
+Run from the repository root: python3 -m unittest tests.test_history"""
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from gasket.history import HistoryStore
+
+
+def make_text(i):
+    """A faucet acl like file, that changes in one port acl per generation,
+    and comes back to an earlier version every 5 generations.
+    """
+    if i % 5 == 0:
+        i = 0
+    lines = ['acls:\n']
+    for port in range(4):
+        lines.append('  port_faucet-1_%d:\n' % port)
+        if port == i % 4:
+            lines.append('  - rule: {dl_src: 00:00:00:00:00:%02x}\n' % i)
+        lines.append('  - rule: {actions: {allow: 1}}\n')
+    return ''.join(lines)
+
+
+class HistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'faucet-acls')
+        # generation : text
+        self.texts = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def open_store(self):
+        return HistoryStore(self.path, keyframe_interval=4, keep=10)
+
+    def append(self, store, count):
+        for _ in range(count):
+            i = store.generation + 1
+            self.texts[i] = make_text(i)
+            self.assertEqual(store.append(make_text(i)), i)
+
+    def assert_kept(self, store, first, last):
+        self.assertEqual([gen for gen, _, _ in store.generations], list(range(first, last + 1)))
+        for gen in range(first, last + 1):
+            self.assertEqual(store.get(gen), self.texts[gen])
+
+    def test_round_trip(self):
+        store = HistoryStore(self.path, keyframe_interval=4)
+        self.append(store, 20)
+        self.assert_kept(store, 1, 20)
+        self.assert_kept(HistoryStore(self.path, keyframe_interval=4), 1, 20)
+
+    def test_identical_generation_is_not_stored_again(self):
+        store = self.open_store()
+        self.append(store, 9)
+        pack_size = os.path.getsize(self.path + '.pack')
+        self.append(store, 1)
+        # generation 10 is the same as 5.
+        self.assertEqual(store.generations[9][2], store.generations[4][2])
+        self.assertEqual(os.path.getsize(self.path + '.pack'), pack_size)
+
+    def test_round_trip_across_compaction_and_reopen(self):
+        store = self.open_store()
+        for _ in range(6):
+            self.append(store, 7)
+            # compacts once 4 (keyframe_interval) generations have expired.
+            first = store.generations[0][0]
+            self.assertLess(store.generation - first, 10 + 4)
+            self.assert_kept(store, first, store.generation)
+            store = self.open_store()
+            self.assert_kept(store, first, store.generation)
+        self.assertGreater(first, 1)
+
+    def test_compact_max_age(self):
+        store = HistoryStore(self.path, keyframe_interval=4, max_age=60)
+        self.append(store, 10)
+        store.compact(time.time() + 120)
+        # the newest is always kept.
+        self.assert_kept(store, 10, 10)
+        self.assert_kept(HistoryStore(self.path, keyframe_interval=4, max_age=60), 10, 10)
+
+    def crash_compaction(self, replaces):
+        """Appends until a compaction, which crashes after replaces files have been replaced.
+        Returns:
+            the generation before the compaction.
+        """
+        store = self.open_store()
+        self.append(store, 13)
+        os_replace = os.replace
+        calls = []
+
+        def replace(src, dst):
+            if len(calls) == replaces:
+                raise OSError('crashed')
+            calls.append(src)
+            os_replace(src, dst)
+
+        with mock.patch('gasket.history.os.replace', replace):
+            with self.assertRaises(OSError):
+                self.append(store, 1)
+        return 13
+
+    def test_recover_before_pack_replaced(self):
+        last = self.crash_compaction(0)
+        self.assertTrue(os.path.exists(self.path + '.pack.new'))
+        self.assertTrue(os.path.exists(self.path + '.idx.new'))
+        store = self.open_store()
+        self.assertFalse(os.path.exists(self.path + '.pack.new'))
+        self.assertFalse(os.path.exists(self.path + '.idx.new'))
+        # the old pack & index, including the generation being appended.
+        self.assert_kept(store, 1, last + 1)
+        self.append(store, 1)
+        self.assert_kept(self.open_store(), last + 2 - 10 + 1, last + 2)
+
+    def test_recover_after_pack_replaced(self):
+        last = self.crash_compaction(1)
+        self.assertFalse(os.path.exists(self.path + '.pack.new'))
+        self.assertTrue(os.path.exists(self.path + '.idx.new'))
+        store = self.open_store()
+        self.assertFalse(os.path.exists(self.path + '.idx.new'))
+        # the compacted pack & index.
+        self.assert_kept(store, last + 1 - 10 + 1, last + 1)
+        self.append(store, 1)
+        self.assert_kept(self.open_store(), last + 1 - 10 + 1, last + 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""Unit tests for gasket.reload_confirmer (no mininet needed).
+Run from the repository root: python3 -m unittest tests.test_reload_confirmer"""
+
+# pylint: disable=missing-docstring
+
+import os
+import unittest
+
+from gasket.reload_confirmer import Generation, ReloadConfirmer, ReloadWaiter
+
+
+class FakeRuleManager(object):
+
+    def __init__(self):
+        self.signals = 0
+        self.reload_count = 0
+        self.signal_error = None
+        self.resolved = []
+
+    def send_signal(self, signal_type):
+        if self.signal_error:
+            raise self.signal_error
+        self.signals += 1
+
+    def get_faucet_reload_count(self):
+        return self.reload_count
+
+    def reload_resolved(self, generation):
+        self.resolved.append(generation)
+
+
+class ReloadConfirmerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rule_man = FakeRuleManager()
+        self.waiter = ReloadWaiter()
+        # faucet events are being received.
+        self.waiter.active = True
+        self.confirmer = ReloadConfirmer(self.rule_man, self.waiter, os.devnull)
+
+    def test_confirmed_by_event(self):
+        generation = Generation(1, [('auth', 'user', '00:00:00:00:00:01')])
+        self.confirmer.submit(generation)
+        self.confirmer.poll()
+        self.assertEqual(self.rule_man.signals, 1)
+        self.assertEqual(self.rule_man.resolved, [])
+        self.waiter.notify()
+        self.confirmer.poll()
+        self.assertEqual(self.rule_man.resolved, [generation])
+        self.assertTrue(generation.confirmed)
+
+    def test_late_event_with_several_dps(self):
+        self.waiter.dps = 2
+        g1 = Generation(1, [('auth', 'user', '00:00:00:00:00:01')])
+        self.confirmer.submit(g1)
+        self.confirmer.poll()
+        # faucet reloads g1, and the first datapath's event arrives.
+        self.rule_man.reload_count += 1
+        self.waiter.notify()
+        self.confirmer.poll()
+        self.assertEqual(self.rule_man.resolved, [g1])
+        g2 = Generation(2, [('deauth', 'user', '00:00:00:00:00:01')])
+        self.confirmer.submit(g2)
+        self.confirmer.poll()
+        # the second datapath's event for g1 arrives after g2 was signalled.
+        self.waiter.notify()
+        self.confirmer.poll()
+        self.assertEqual(self.rule_man.resolved, [g1])
+        self.assertFalse(g2.confirmed)
+        self.rule_man.reload_count += 1
+        self.confirmer.poll()
+        self.assertEqual(self.rule_man.resolved, [g1, g2])
+        self.assertTrue(g2.confirmed)
+
+    def test_signal_error_fails_generations(self):
+        self.rule_man.signal_error = FileNotFoundError('no pid file')
+        generations = [Generation(1, [('auth', 'user', '00:00:00:00:00:01')]),
+                       Generation(2, [('deauth', 'user', '00:00:00:00:00:01')])]
+        for generation in generations:
+            self.confirmer.submit(generation)
+        self.confirmer.poll()
+        self.assertEqual(self.rule_man.resolved, generations)
+        self.assertTrue(all(g.failed and not g.confirmed for g in generations))
+        self.assertEqual(self.confirmer.outstanding, [])
+        self.assertEqual(self.confirmer.unsent, [])
+
+    def test_resend_error_fails_generation(self):
+        generation = Generation(1, [('auth', 'user', '00:00:00:00:00:01')])
+        self.confirmer.submit(generation)
+        self.confirmer.poll()
+        self.rule_man.signal_error = OSError('faucet has gone')
+        generation.sent_time -= self.confirmer.timeout + 1
+        self.confirmer.poll()
+        self.assertEqual(self.rule_man.resolved, [generation])
+        self.assertTrue(generation.failed)
+        self.assertEqual(self.confirmer.outstanding, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
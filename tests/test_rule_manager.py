@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""Unit tests for gasket.rule_manager (no mininet needed).
+Run from the repository root: python3 -m unittest tests.test_rule_manager"""
+
+# pylint: disable=missing-docstring
+
+import logging
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from gasket import rule_manager
+
+
+GASKET_ETC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'etc', 'faucet', 'gasket')
+USERS = [('user%d' % i, '00:00:00:00:00:0%d' % i) for i in range(3)]
+
+
+class RuleManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        base = os.path.join(self.tmpdir, 'base.yaml')
+        faucet_acls = os.path.join(self.tmpdir, 'faucet-acls.yaml')
+        shutil.copy(os.path.join(GASKET_ETC, 'base-no-authed-acls.yaml'), base)
+        logger = logging.getLogger('test_rule_manager')
+        rule_manager.write_yaml(rule_manager.create_faucet_acls(
+            rule_manager.load_config(base), logger), faucet_acls, True)
+        config = types.SimpleNamespace(
+            rules=os.path.join(GASKET_ETC, 'rules.yaml'), rules_backend='yaml',
+            rules_cache_size=1024, base_filename=base, base_config_format='yaml',
+            acl_config_file=faucet_acls, acl_config_format='yaml', shared_blocks=False,
+            journal=None, journal_compact=1000, fsync='none', history_dir=None,
+            backup=False, backup_keep=0, backup_max_age=0,
+            reload_batch_window=0, reload_batch_size=0, reload_timeout=20,
+            reload_retries=1, reload_backoff_max=600, dps={'faucet-1': {}},
+            logger_location=os.devnull, prom_url='http://localhost:9302',
+            container_name='', contr_pid_file='')
+        self.rule_man = rule_manager.RuleManager(config, logger)
+        self.faucet_acls = faucet_acls
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_faucet_acls(self):
+        with open(self.faucet_acls) as f:
+            return f.read()
+
+    def test_reauth_in_one_commit_is_suppressed(self):
+        for username, mac in USERS:
+            self.rule_man.authenticate(username, mac, 'faucet-1', 3, ['student'])
+        self.rule_man.commit()
+        before = self.read_faucet_acls()
+        port_acl = list(self.rule_man.base['acls']['port_faucet-1_3'])
+
+        username, mac = USERS[0]
+        self.rule_man.deauthenticate(username, mac)
+        self.rule_man.authenticate(username, mac, 'faucet-1', 3, ['student'])
+        self.rule_man.commit()
+        self.assertEqual(self.rule_man.suppressed_reloads, 1)
+        self.assertEqual(self.read_faucet_acls(), before)
+        self.assertEqual(self.rule_man.base['acls']['port_faucet-1_3'], port_acl)
+
+    def test_deauth_removes_entry(self):
+        for username, mac in USERS:
+            self.rule_man.authenticate(username, mac, 'faucet-1', 3, ['student'])
+        self.rule_man.commit()
+        port_acl_len = len(self.rule_man.base['acls']['port_faucet-1_3'])
+
+        username, mac = USERS[1]
+        self.rule_man.deauthenticate(username, mac)
+        self.rule_man.commit()
+        self.assertEqual(self.rule_man.suppressed_reloads, 0)
+        self.assertNotIn(mac, self.read_faucet_acls())
+        self.assertEqual(len(self.rule_man.base['acls']['port_faucet-1_3']), port_acl_len - 1)
+        self.assertEqual(self.rule_man.removed_entries, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""Unit tests for gasket.work_queue (no mininet needed).
+Run from the repository root: python3 -m unittest tests.test_work_queue"""
+
+# pylint: disable=missing-docstring
+
+import queue
+import unittest
+
+from gasket.work_item import AuthWorkItem, DeauthWorkItem, L2LearnWorkItem, PortChangeWorkItem
+from gasket.work_queue import PriorityWorkQueue
+
+
+MAC = '00:00:00:00:00:01'
+OTHER_MAC = '00:00:00:00:00:02'
+
+
+def learn(mac, port):
+    return L2LearnWorkItem('faucet-1', 1, port, 100, mac, '10.0.0.1')
+
+
+def auth(mac):
+    return AuthWorkItem(mac, 'user', ['student'], 'hostapd-1')
+
+
+def port_change(port, status):
+    return PortChangeWorkItem('faucet-1', 1, port, 2, status)
+
+
+class PriorityWorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_queue = PriorityWorkQueue()
+
+    def put(self, *items):
+        for item in items:
+            self.work_queue.put(item)
+
+    def drain(self):
+        items = []
+        while not self.work_queue.empty():
+            items.append(self.work_queue.get(block=False))
+        return items
+
+    def test_priority(self):
+        items = [learn(OTHER_MAC, 2), auth(MAC), DeauthWorkItem(OTHER_MAC, 'hostapd-1')]
+        self.put(*items)
+        self.assertEqual(self.drain(), items[::-1])
+
+    def test_auth_after_older_learn_of_same_mac(self):
+        # host learnt on port 1, moves to port 2, then authenticates.
+        # The auth must be done on port 2, so after the learn.
+        move, authenticate = learn(MAC, 2), auth(MAC)
+        self.put(move, authenticate)
+        self.assertEqual(self.drain(), [move, authenticate])
+
+    def test_auth_ahead_of_learn_of_other_mac(self):
+        other, authenticate = learn(OTHER_MAC, 2), auth(MAC)
+        self.put(other, authenticate)
+        self.assertEqual(self.drain(), [authenticate, other])
+
+    def test_auth_ahead_of_newer_learn_of_same_mac(self):
+        authenticate, move = auth(MAC), learn(MAC, 2)
+        self.put(authenticate, move)
+        self.assertEqual(self.drain(), [authenticate, move])
+
+    def test_auth_after_superseded_learn(self):
+        # the learn is removed by the port going down, so does not hold the auth back.
+        move, down, authenticate = learn(MAC, 2), port_change(2, False), auth(MAC)
+        other = learn(OTHER_MAC, 3)
+        self.put(move, other, down, authenticate)
+        self.assertEqual(self.drain(), [down, authenticate, other])
+
+    def test_port_change_not_ahead_of_auth(self):
+        authenticate, down = auth(MAC), port_change(2, False)
+        self.put(authenticate, down)
+        self.assertEqual(self.drain(), [authenticate, down])
+
+    def test_port_change_not_ahead_of_auth_held_by_learn(self):
+        move, authenticate, down = learn(MAC, 2), auth(MAC), port_change(3, False)
+        self.put(move, authenticate, down)
+        self.assertEqual(self.drain(), [move, authenticate, down])
+
+    def test_deauth_supersedes_auth(self):
+        authenticate, deauthenticate = auth(MAC), DeauthWorkItem(MAC, 'hostapd-1')
+        self.put(authenticate, deauthenticate)
+        self.assertEqual(self.drain(), [deauthenticate])
+        self.assertEqual(self.work_queue.stats()['auth']['superseded'], 1)
+
+    def test_starvation(self):
+        self.work_queue = PriorityWorkQueue(max_skip=2)
+        other = learn(OTHER_MAC, 2)
+        auths = [auth('00:00:00:00:01:%02x' % i) for i in range(4)]
+        self.put(other, *auths)
+        self.assertEqual(self.drain(), auths[:2] + [other] + auths[2:])
+
+    def test_empty(self):
+        self.assertRaises(queue.Empty, self.work_queue.get, False)
+        self.assertRaises(queue.Empty, self.work_queue.get, True, 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()